@@ -0,0 +1,53 @@
+'''Measures the memory the receive path allocates per small frame.
+
+The same small frame is fed through a Connection over and over, and the
+peak memory allocated while each one is parsed is measured. In steady
+state the parser and the receive buffer are reused, so what's allocated
+should be no more than the delivered event and its payload.
+
+    python benchmarks/allocations.py
+'''
+import os
+import sys
+import tracemalloc
+
+import noio_ws as ws
+
+FRAME_SIZE = 16
+FRAMES = 10000
+
+
+def measure(conn, frame, count):
+    '''Feeds frame in count times, returning the average memory allocated
+    at once while parsing it, in bytes.'''
+    total = 0
+    for _ in range(count):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        conn.recv(frame)
+        event = conn.next_event()
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - before
+        del event
+    return total / count
+
+
+def main():
+    server = ws.Connection('SERVER')
+    frame = server.send(ws.SendFrame(os.urandom(FRAME_SIZE), 'binary'))
+    conn = ws.Connection('CLIENT', timestamps=False)
+    # Warm up, so the buffer has grown to size and the parser exists.
+    measure(conn, frame, 10)
+
+    tracemalloc.start()
+    per_frame = measure(conn, frame, FRAMES)
+    tracemalloc.stop()
+    payload = sys.getsizeof(bytearray(FRAME_SIZE))
+    event = sys.getsizeof(ws.ReceivedFrame(True, b'', 'binary'))
+    print('{} byte frames: {:.0f} bytes allocated per frame, {:.0f} '
+          'beyond the delivered event and payload'.format(
+              FRAME_SIZE, per_frame, per_frame - payload - event))
+
+
+if __name__ == '__main__':
+    main()
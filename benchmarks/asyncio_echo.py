@@ -0,0 +1,101 @@
+'''Round trips small messages through an echo server over loopback with the
+asyncio transport, from many clients at once. If the websockets library
+is installed, the same is done with it for comparison, and its clients are
+run against the noio_ws server.
+
+    python benchmarks/asyncio_echo.py
+'''
+import asyncio
+import time
+
+from noio_ws.asyncio import connect, serve
+
+CLIENTS = 100
+MESSAGES = 1000
+PAYLOAD = b'x' * 64
+
+
+async def noio_ws_echo(sock):
+    async for message in sock:
+        await sock.send(message)
+
+
+async def run_noio_ws():
+    server = await serve(noio_ws_echo, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    clients = [await connect('ws://127.0.0.1:{}/'.format(port))
+               for _ in range(CLIENTS)]
+    elapsed = await run_clients(clients)
+    for client in clients:
+        await client.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+async def run_websockets_client():
+    '''websockets clients against the noio_ws server, which also checks the
+    server's handshake accepts another library's client.'''
+    import websockets
+
+    server = await serve(noio_ws_echo, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    clients = [await websockets.connect('ws://127.0.0.1:{}/'.format(port),
+                                        compression=None)
+               for _ in range(CLIENTS)]
+    elapsed = await run_clients(clients)
+    for client in clients:
+        await client.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+async def run_websockets():
+    import websockets
+
+    async def echo(sock, path=None):
+        async for message in sock:
+            await sock.send(message)
+
+    server = await websockets.serve(echo, '127.0.0.1', 0, compression=None)
+    port = next(iter(server.sockets)).getsockname()[1]
+    clients = [await websockets.connect('ws://127.0.0.1:{}/'.format(port),
+                                        compression=None)
+               for _ in range(CLIENTS)]
+    elapsed = await run_clients(clients)
+    for client in clients:
+        await client.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+async def run_clients(clients):
+    async def client_task(client):
+        for _ in range(MESSAGES):
+            await client.send(PAYLOAD)
+            await client.recv()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_task(client) for client in clients))
+    return time.perf_counter() - start
+
+
+def main():
+    runs = [('noio_ws', run_noio_ws)]
+    try:
+        import websockets  # noqa
+    except ImportError:
+        print('websockets is not installed, so not comparing with it.')
+    else:
+        runs.append(('websockets', run_websockets))
+        runs.append(('mixed', run_websockets_client))
+    for name, run in runs:
+        elapsed = asyncio.run(run())
+        print('{:>10}: {} clients, {:8.0f} round trips/s'.format(
+            name, CLIENTS, CLIENTS * MESSAGES / elapsed))
+
+
+if __name__ == '__main__':
+    main()
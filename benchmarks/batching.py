@@ -0,0 +1,61 @@
+'''Sends 10k small text frames over a socketpair, first writing each frame
+as it is sent, then through a FrameBatcher, counting the writes made.
+
+    python benchmarks/batching.py
+'''
+import socket
+import threading
+import time
+
+import noio_ws as ws
+from noio_ws.batching import FrameBatcher
+
+FRAMES = 10000
+MESSAGE = '{"symbol": "ABCD", "bid": 101.25, "ask": 101.27}'
+
+
+def drain(sock, total):
+    '''Reads until total bytes have arrived.'''
+    received = 0
+    while received < total:
+        received += len(sock.recv(1 << 20))
+
+
+def run(batched):
+    a, b = socket.socketpair()
+    conn = ws.Connection('SERVER')
+    writes = 0
+
+    def write(data):
+        nonlocal writes
+        writes += 1
+        a.sendall(data)
+
+    total = FRAMES * len(conn.send(ws.SendFrame(MESSAGE, 'text')))
+    reader = threading.Thread(target=drain, args=(b, total))
+    reader.start()
+    start = time.perf_counter()
+    if batched:
+        batcher = FrameBatcher(conn, write)
+        for _ in range(FRAMES):
+            batcher.send(ws.SendFrame(MESSAGE, 'text'))
+        batcher.flush()
+    else:
+        for _ in range(FRAMES):
+            write(conn.send(ws.SendFrame(MESSAGE, 'text')))
+    reader.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return writes, elapsed
+
+
+def main():
+    for name, batched in (('unbatched', False), ('batched', True)):
+        writes, elapsed = run(batched)
+        print('{:>10}: {:6} writes, {:8.0f} frames/s'.format(
+            name, writes, FRAMES / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+'''Encodes a 64 MiB message read from a file, first whole with
+Connection.send, then in 64 KiB frames with Connection.send_fragments,
+comparing the peak memory used and how many bytes could be queued ahead of
+a ping sent while the message is going out.
+
+    python benchmarks/fragmentation.py
+'''
+import os
+import tempfile
+import time
+import tracemalloc
+
+import noio_ws as ws
+
+SIZE = 64 << 20
+
+
+def whole(conn, f):
+    # The ping can only follow the whole message.
+    yield conn.send(ws.SendFrame(f.read(), 'binary'))
+
+
+def fragmented(conn, f):
+    return conn.send_fragments(f)
+
+
+def main():
+    with tempfile.TemporaryFile() as f:
+        f.write(os.urandom(SIZE))
+        for role in ('SERVER', 'CLIENT'):
+            for name, encode in (('whole', whole),
+                                 ('fragments', fragmented)):
+                f.seek(0)
+                conn = ws.Connection(role)
+                tracemalloc.start()
+                start = time.perf_counter()
+                ahead = 0
+                for frame in encode(conn, f):
+                    ahead = max(ahead, len(frame))
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('{:>6} {:>9}: {:7.1f} MiB/s, peak {:6.1f} MiB, '
+                      '{:6.1f} MiB ahead of a ping'.format(
+                          role, name, SIZE / elapsed / (1 << 20),
+                          peak / (1 << 20), ahead / (1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
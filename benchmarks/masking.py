@@ -0,0 +1,44 @@
+'''Compares the payload masking backends across a range of payload sizes.
+
+    python benchmarks/masking.py
+'''
+import os
+from timeit import Timer
+
+from noio_ws.masking import BACKEND, BACKENDS
+
+SIZES = [64, 4 * 1024, 64 * 1024, 16 * 1024 * 1024]
+# The byte at a time loop takes seconds per 16 MiB pass, so cap it.
+LOOP_LIMIT = 64 * 1024
+
+
+def human(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '{}{}'.format(size, unit)
+        size //= 1024
+    return '{}GiB'.format(size)
+
+
+def bench(func, size, mask):
+    data = bytearray(os.urandom(size))
+    timer = Timer(lambda: func(data, mask))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(3, number)) / number
+    return best, size / best / (1024 * 1024)
+
+
+def main():
+    mask = os.urandom(4)
+    print('default backend:', BACKEND)
+    for size in SIZES:
+        for name, func in BACKENDS.items():
+            if name == 'loop' and size > LOOP_LIMIT:
+                continue
+            secs, rate = bench(func, size, mask)
+            print('{:>8} {:>6}: {:12.2f} us {:10.1f} MiB/s'.format(
+                human(size), name, secs * 1e6, rate))
+
+
+if __name__ == '__main__':
+    main()
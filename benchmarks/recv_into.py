@@ -0,0 +1,74 @@
+'''Compares feeding a Connection with recv(bytes) against writing straight in
+to its buffer with get_buffer / buffer_updated, as sock.recv_into would.
+
+An in memory stream stands in for the socket so that only the receive
+path's own allocations are measured. For every read, the memory allocated
+and freed again within that read is summed up and reported per MB.
+
+    python benchmarks/recv_into.py
+'''
+import io
+import os
+import time
+import tracemalloc
+
+import noio_ws as ws
+
+READ_SIZE = 2048
+FRAME_SIZE = 100
+TOTAL = 8 * 1024 * 1024
+
+
+def make_stream():
+    server = ws.Connection('SERVER')
+    frame = server.send(ws.SendFrame(os.urandom(FRAME_SIZE), 'binary'))
+    return frame * (TOTAL // len(frame))
+
+
+def via_recv(conn, stream):
+    chunk = stream.read(READ_SIZE)
+    conn.recv(chunk)
+    return len(chunk)
+
+
+def via_recv_into(conn, stream):
+    nbytes = stream.readinto(conn.get_buffer(READ_SIZE))
+    conn.buffer_updated(nbytes)
+    return nbytes
+
+
+def run(reader, wire, trace):
+    conn = ws.Connection('CLIENT')
+    stream = io.BytesIO(wire)
+    transient = 0
+    start = time.perf_counter()
+    while True:
+        if trace:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        nbytes = reader(conn, stream)
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            transient += peak - before
+        for event in conn.events():
+            pass
+        if not nbytes:
+            break
+    elapsed = time.perf_counter() - start
+    return elapsed, transient
+
+
+def main():
+    wire = make_stream()
+    megs = len(wire) / (1024 * 1024)
+    for name, reader in (('recv', via_recv), ('recv_into', via_recv_into)):
+        elapsed, _ = run(reader, wire, trace=False)
+        tracemalloc.start()
+        _, transient = run(reader, wire, trace=True)
+        tracemalloc.stop()
+        print('{:>10}: {:8.1f} MiB/s {:10.1f} KiB allocated per MB'.format(
+            name, megs / elapsed, transient / 1024 / megs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''Encodes a burst of small messages one send at a time and joined, against
+Connection.send_many encoding them all in to one buffer, given as
+(data, f_type) tuples and as SendFrames.
+
+    python benchmarks/send_many.py
+'''
+import os
+import time
+
+import noio_ws as ws
+
+BURST = 1000
+ROUNDS = 200
+PAYLOAD = os.urandom(64)
+
+
+def one_at_a_time(conn, messages):
+    return b''.join([conn.send(ws.SendFrame(data, f_type))
+                     for data, f_type in messages])
+
+
+def all_at_once(conn, messages):
+    return conn.send_many(messages)
+
+
+def all_at_once_frames(conn, messages):
+    return conn.send_many([ws.SendFrame(data, f_type)
+                           for data, f_type in messages])
+
+
+def main():
+    messages = [(PAYLOAD, 'binary')] * BURST
+    for role in ('SERVER', 'CLIENT'):
+        for name, encode in (('send', one_at_a_time),
+                             ('send_many', all_at_once),
+                             ('frames', all_at_once_frames)):
+            conn = ws.Connection(role)
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                encode(conn, messages)
+            elapsed = time.perf_counter() - start
+            print('{:>6} {:>9}: {:9.0f} messages/s'.format(
+                role, name, BURST * ROUNDS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
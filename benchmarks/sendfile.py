@@ -0,0 +1,56 @@
+'''Sends a 256 MiB file from a server to a client over loopback with the
+asyncio transport, first read in to memory and sent as bytes, then as a
+FileFrame with loop.sendfile, then as a FileFrame with sendfile made
+unavailable, so it is written from mmap.
+
+    python benchmarks/sendfile.py
+'''
+import asyncio
+import os
+import tempfile
+import time
+
+import noio_ws as ws
+from noio_ws.asyncio import connect, serve
+
+SIZE = 256 << 20
+
+
+async def run(path, how):
+    async def handler(sock):
+        if how == 'bytes':
+            with open(path, 'rb') as f:
+                await sock.send(f.read())
+        else:
+            if how == 'mmap':
+                async def unavailable(*args, **kwargs):
+                    raise asyncio.SendfileNotAvailableError
+                sock.loop.sendfile = unavailable
+            with ws.FileFrame(path) as frame:
+                await sock.send(frame)
+        await sock.recv()
+
+    server = await serve(handler, '127.0.0.1', 0, max_frame_size=SIZE)
+    port = server.sockets[0].getsockname()[1]
+    client = await connect('ws://127.0.0.1:{}/'.format(port))
+    start = time.perf_counter()
+    message = await client.recv()
+    elapsed = time.perf_counter() - start
+    assert len(message) == SIZE
+    await client.close()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+def main():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(os.urandom(SIZE))
+        f.flush()
+        for how in ('bytes', 'sendfile', 'mmap'):
+            elapsed = asyncio.run(run(f.name, how))
+            print('{:>8}: {:7.1f} MiB/s'.format(how, SIZE / elapsed / (1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''Receives a 256 MiB message sent in 64 KiB fragments with full_message
+set, first assembled in memory, then spilled to a temporary file past
+spill_threshold, comparing the peak memory used.
+
+    python benchmarks/spill.py
+'''
+import os
+import time
+import tracemalloc
+
+import noio_ws as ws
+
+SIZE = 256 << 20
+FRAME_SIZE = 65536
+
+
+def main():
+    sender = ws.Connection('SERVER')
+    chunk = os.urandom(FRAME_SIZE)
+    first = sender.send(ws.SendFrame(chunk, 'binary', fin=False))
+    middle = sender.send(ws.SendFrame(chunk, 'continue', fin=False))
+    last = sender.send(ws.SendFrame(chunk, 'continue'))
+    for name, kwargs in (('in memory', {}),
+                         ('spilled', {'spill_threshold': 1 << 20})):
+        conn = ws.Connection('CLIENT', full_message=True, **kwargs)
+        tracemalloc.start()
+        start = time.perf_counter()
+        conn.recv(first)
+        for _ in range(SIZE // FRAME_SIZE - 2):
+            conn.recv(middle)
+        conn.recv(last)
+        message = conn.next_event()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{:>9}: {:7.1f} MiB/s, peak {:6.1f} MiB'.format(
+            name, SIZE / elapsed / (1 << 20), peak / (1 << 20)))
+        assert len(message.view()) == SIZE
+        del message
+
+
+if __name__ == '__main__':
+    main()
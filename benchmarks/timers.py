@@ -0,0 +1,92 @@
+'''Drives the keepalives of 100k idle connections from one TimerWheel.
+
+Every connection pings every 30 seconds, and all but one in a hundred peers
+answer. Two simulated minutes are run in 100ms steps, with the wheel
+handing back only the connections whose deadline is up. That is compared
+with the naive alternative of checking every connection's next_deadline on
+every step.
+
+    python benchmarks/timers.py
+'''
+import time
+
+import noio_ws as ws
+from noio_ws.timers import TimerWheel
+
+CONNECTIONS = 100000
+INTERVAL = 30
+TIMEOUT = 10
+STEP = 0.1
+DURATION = 120
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_pong(conn, pongs={}):
+    '''Answers the connection's outstanding ping, as its peer would. Pings
+    only differ by their counter, so the pongs are cached.'''
+    payload = conn.keepalive.awaiting
+    if payload not in pongs:
+        peer = ws.Connection('SERVER')
+        pongs[payload] = peer.send(ws.SendFrame(payload, 'pong'))
+    return pongs[payload]
+
+
+def main():
+    clock = Clock()
+    conns = [ws.Connection('CLIENT', keepalive=ws.Keepalive(INTERVAL, TIMEOUT),
+                           clock=clock)
+             for _ in range(CONNECTIONS)]
+    dead = set(conns[::100])
+
+    start = time.perf_counter()
+    wheel = TimerWheel(clock.now)
+    for conn in conns:
+        wheel.schedule(conn, conn.next_deadline())
+    scheduled = time.perf_counter() - start
+
+    pings = closed = 0
+    steps = int(DURATION / STEP)
+    in_wheel = 0.0
+    start = time.perf_counter()
+    for _ in range(steps):
+        clock.now += STEP
+        before = time.perf_counter()
+        due = wheel.advance(clock.now)
+        in_wheel += time.perf_counter() - before
+        for conn in due:
+            result = conn.tick(clock.now)
+            if result is ws.Information.SEND_PING:
+                pings += 1
+                conn.data_to_send()
+                if conn not in dead:
+                    conn.recv(make_pong(conn))
+            elif result is ws.Information.CONNECTION_CLOSED:
+                closed += 1
+            wheel.schedule(conn, conn.next_deadline())
+    total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for conn in conns:
+        deadline = conn.next_deadline()
+        if deadline is not None and deadline <= clock.now:
+            pass
+    scan = time.perf_counter() - start
+
+    print('{} connections, {} pings, {} timed out'.format(
+        CONNECTIONS, pings, closed))
+    print('scheduling all: {:.3f}s'.format(scheduled))
+    print('{} steps: {:.3f}s in all, {:.3f}s in the wheel, {:.1f}us per '
+          'advance'.format(steps, total, in_wheel, in_wheel / steps * 1e6))
+    print('naive scan of every connection: {:.1f}us per step'.format(
+        scan * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
 from .connection import Connection
-from .structs import SendFrame, Message, ReceivedFrame, ControlMessage, TypeFrameBuffer
+from .structs import SendFrame, PreparedFrame, FileFrame, Message, ReceivedFrame, ControlMessage, PayloadChunk, TypeFrameBuffer
 from .constants import Roles, Information
+from .deflate import PerMessageDeflate, CompressorPool
+from .keepalive import Keepalive
+from .errors import (NnwsProtocolError, NnwsInvalidPayloadError,
+                     NnwsMessageTooBigError, NnwsConnectionClosed)
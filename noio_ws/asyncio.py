@@ -0,0 +1,554 @@
+'''An asyncio transport for noio_ws.
+
+connect opens a client websocket and serve starts a websocket server, both
+doing the opening handshake with Handshake and then handing every byte to a
+Connection. Either way the result is a WebSocket::
+
+    ws = await connect('ws://localhost:8765/')
+    await ws.send('hello')
+    async for message in ws:
+        ...
+
+    async def handler(ws):
+        async for message in ws:
+            await ws.send(message)
+
+    server = await serve(handler, 'localhost', 8765)
+
+WebSocket is an asyncio.BufferedProtocol, so incoming data is read straight
+in to the Connection's own buffer, and outgoing frames are written as a
+header and payload with writelines, so the payload isn't copied. Reading is
+paused while max_queue messages are waiting to be received, and send waits
+while the transport's write buffer is full.'''
+import asyncio
+from collections import deque
+from struct import Struct
+from urllib.parse import urlparse
+
+import h11
+
+from .connection import Connection
+from .constants import CStates, Information, valid_close_code
+from .errors import (NnwsProtocolError, NnwsInvalidPayloadError,
+                     NnwsConnectionClosed)
+from .handshake_utils import Handshake
+from .keepalive import Keepalive
+from .structs import SendFrame, PreparedFrame, FileFrame
+
+
+__all__ = ['WebSocket', 'connect', 'serve']
+
+STATUS_CODE = Struct('!H')
+
+
+class WebSocket(asyncio.BufferedProtocol):
+    '''One websocket, client or server. Made by connect and serve rather than
+    directly.
+
+    Any keyword arguments not listed are passed on to the Connection, such
+    as max_buffer.'''
+    # The most read at once while the opening handshake is going on.
+    HANDSHAKE_READ_SIZE = 4096
+
+    def __init__(self, role, uri=None, handler=None, *,
+                 subprotocols=None,
+                 deflate=False,
+                 max_queue=64,
+                 close_timeout=10,
+                 ping_interval=None,
+                 ping_timeout=None,
+                 **connection_kwargs):
+        self.loop = asyncio.get_running_loop()
+        self.role = role
+        self.uri = uri
+        self.handler = handler
+        self.subprotocols = subprotocols
+        self.deflate = deflate
+        self.max_queue = max_queue
+        self.close_timeout = close_timeout
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.connection_kwargs = connection_kwargs
+
+        self.shaker = Handshake(role)
+        self.handshake_buffer = bytearray(self.HANDSHAKE_READ_SIZE)
+        self.request = None
+        # The request's target, for servers.
+        self.path = None
+        self.subprotocol = None
+        self.extensions = None
+
+        self.conn = None
+        self.transport = None
+        self.opened = self.loop.create_future()
+        self.lost = self.loop.create_future()
+        self.handler_task = None
+        self.timer = None
+        self.close_timer = None
+
+        self.messages = deque()
+        self.message_waiter = None
+        self.drain_waiters = deque()
+        # Held while a message is sent in fragments, so that no other data
+        # frame is sent in the middle of it.
+        self.fragment_lock = asyncio.Lock()
+        # Set while a FileFrame's payload is being written. Nothing else can
+        # be written then, so frames the Connection makes its self are kept
+        # queued until it is done.
+        self.sending_file = False
+        self.reading_paused = False
+        self.writing_paused = False
+
+        # Set once a close frame arrives or the connection is lost.
+        self.close_code = None
+        self.close_reason = ''
+        self.exception = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except NnwsConnectionClosed:
+            raise StopAsyncIteration
+
+    @property
+    def closed(self):
+        return self.lost.done()
+
+    # Opening handshake.
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.role == 'CLIENT':
+            hcon = self.shaker.hcon
+            request = self.shaker.client_handshake(
+                self.uri, subprotocols=self.subprotocols, deflate=self.deflate)
+            transport.write(hcon.send(request) + hcon.send(h11.EndOfMessage()))
+
+    def http_events(self):
+        '''Works through the opening handshake's h11 events, opening the
+        websocket once the handshake is done.'''
+        hcon = self.shaker.hcon
+        while True:
+            event = hcon.next_event()
+            if event is h11.NEED_DATA:
+                return
+            if self.role == 'CLIENT':
+                if isinstance(event, h11.InformationalResponse):
+                    if event.status_code != 101:
+                        continue
+                    self.extensions, protocols = self.shaker.verify_response(
+                        event)
+                    self.subprotocol = next(iter(protocols), None)
+                    return self.open(hcon.trailing_data[0])
+                if isinstance(event, h11.Response):
+                    raise NnwsProtocolError('Handshake refused:',
+                                            event.status_code)
+            elif isinstance(event, h11.Request):
+                self.request = event
+                self.path = event.target.decode('utf-8')
+                self.extensions, protocols = self.shaker.verify_request(event)
+                for subprotocol in self.subprotocols or ():
+                    if subprotocol in protocols:
+                        self.subprotocol = subprotocol
+                        break
+            elif isinstance(event, h11.EndOfMessage):
+                response = self.shaker.server_handshake(
+                    subprotocols=([self.subprotocol] if self.subprotocol
+                                  else None),
+                    deflate=self.deflate)
+                self.transport.write(hcon.send(response))
+                return self.open(hcon.trailing_data[0])
+
+    def fail_handshake(self, exc):
+        if self.role == 'SERVER':
+            hcon = self.shaker.hcon
+            try:
+                self.transport.write(
+                    hcon.send(h11.Response(status_code=400, headers=[
+                        ('content-length', '0'), ('connection', 'close')])) +
+                    hcon.send(h11.EndOfMessage()))
+            except h11.LocalProtocolError:
+                pass
+        self.abandon_opening(exc)
+        self.transport.close()
+
+    def abandon_opening(self, exc):
+        '''Hands exc to whoever is waiting in connect. Servers have no one
+        waiting.'''
+        if not self.opened.done():
+            if self.role == 'CLIENT':
+                self.opened.set_exception(exc)
+            else:
+                self.opened.cancel()
+
+    def open(self, leftover):
+        keepalive = None
+        if self.ping_interval is not None:
+            keepalive = Keepalive(self.ping_interval, self.ping_timeout)
+        self.conn = Connection(self.role,
+                               full_message=True,
+                               decode_text=True,
+                               auto_pong=True,
+                               deflate=self.shaker.deflate,
+                               keepalive=keepalive,
+                               clock=self.loop.time,
+                               **self.connection_kwargs)
+        self.handshake_buffer = None
+        self.opened.set_result(self)
+        if self.handler is not None:
+            self.handler_task = self.loop.create_task(self.run_handler())
+        self.schedule_tick()
+        if leftover:
+            self.received(self.conn.recv, leftover)
+
+    async def run_handler(self):
+        try:
+            await self.handler(self)
+        except NnwsConnectionClosed:
+            pass
+        except Exception as e:
+            self.loop.call_exception_handler({
+                'message': 'Unhandled exception in websocket handler',
+                'exception': e,
+                'protocol': self})
+            await self.close(1011)
+            return
+        await self.close()
+
+    # Receiving.
+
+    def get_buffer(self, sizehint):
+        if self.conn is None:
+            return self.handshake_buffer
+        return self.conn.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        if self.conn is None:
+            self.shaker.hcon.receive_data(bytes(self.handshake_buffer[:nbytes]))
+            try:
+                self.http_events()
+            except (h11.ProtocolError, NnwsProtocolError) as e:
+                self.fail_handshake(e)
+            return
+        self.received(self.conn.buffer_updated, nbytes)
+
+    def received(self, recv, data):
+        '''Passes data to the Connection with recv, then deals with the
+        events that come out. Messages parsed before a protocol error are
+        still handed over, ahead of the error.'''
+        error = None
+        try:
+            recv(data)
+        except NnwsProtocolError as e:
+            error = e
+        for event in self.conn.events():
+            if event.f_type == 'text' and event.decoded_text is not None:
+                self.messages.append(event.decoded_text)
+            elif event.f_type == 'close':
+                self.close_received(event)
+            elif event.f_type not in ('ping', 'pong'):
+                # Including spilled text, which is left in its file.
+                self.messages.append(event.payload)
+        if error is not None:
+            return self.fail(error)
+        # Any pongs for pings received.
+        self.flush()
+        # A pong moves the keepalive's deadline up.
+        if not self.lost.done():
+            self.schedule_tick()
+        if self.messages:
+            self.wake_receiver()
+            if len(self.messages) >= self.max_queue and not self.reading_paused:
+                self.reading_paused = True
+                self.transport.pause_reading()
+
+    def close_received(self, event):
+        payload = event.payload
+        if len(payload) >= 2:
+            code, = STATUS_CODE.unpack_from(payload)
+            if not valid_close_code(code):
+                return self.fail(NnwsProtocolError('Invalid close code:',
+                                                   code))
+            try:
+                self.close_reason = payload[2:].decode('utf-8')
+            except UnicodeDecodeError:
+                return self.fail(NnwsInvalidPayloadError(
+                    'Invalid UTF-8 in close reason.'))
+            self.close_code = code
+        elif payload:
+            return self.fail(NnwsProtocolError('Close frame with a one '
+                                               'byte payload.'))
+        else:
+            self.close_code = 1005
+        if self.conn.state is CStates.CLOSING:
+            # The other side started the closing handshake, so reply.
+            if len(payload) >= 2:
+                reply = SendFrame(b'', 'close', status_code=self.close_code)
+            else:
+                reply = SendFrame(b'', 'close')
+            self.conn.write(reply)
+            self.flush()
+        # The server closes the TCP connection first, so the client gives it
+        # a little while to.
+        if self.role == 'SERVER':
+            self.transport.close()
+        else:
+            self.close_timer = self.loop.call_later(self.close_timeout,
+                                                    self.transport.close)
+        self.wake_receiver()
+
+    def fail(self, exc):
+        '''Fails the connection after a protocol error.'''
+        self.exception = exc
+        self.close_code = exc.status_code
+        # A close frame can still be sent in reply to the other side's.
+        if (self.conn.state is CStates.OPEN or
+                (self.conn.state is CStates.CLOSING and
+                 not self.conn.close_init_client)):
+            self.conn.write(SendFrame(b'', 'close',
+                                      status_code=exc.status_code))
+            self.flush()
+        self.transport.close()
+        self.wake_receiver()
+
+    def wake_receiver(self):
+        waiter = self.message_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def recv(self):
+        '''Returns the next message, as a str for text messages and a
+        bytearray otherwise. Messages spilled to disk (see spill_threshold)
+        are returned as their temporary file instead, text included.
+        Raises NnwsConnectionClosed once the connection has closed and every
+        message has been received.'''
+        while not self.messages:
+            if self.close_code is not None or self.lost.done():
+                if self.exception is not None:
+                    raise self.exception
+                raise NnwsConnectionClosed(self.close_code or 1006,
+                                           self.close_reason)
+            self.message_waiter = self.loop.create_future()
+            try:
+                await self.message_waiter
+            finally:
+                self.message_waiter = None
+        message = self.messages.popleft()
+        if self.reading_paused and len(self.messages) <= self.max_queue // 2:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        return message
+
+    def eof_received(self):
+        return None
+
+    def connection_lost(self, exc):
+        if self.close_code is None:
+            self.close_code = 1006
+        self.abandon_opening(exc or ConnectionError(
+            'Connection lost during the opening handshake'))
+        for timer in (self.timer, self.close_timer):
+            if timer is not None:
+                timer.cancel()
+        self.lost.set_result(None)
+        self.wake_receiver()
+        self.wake_writers()
+
+    # Sending.
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.wake_writers()
+
+    def wake_writers(self):
+        while self.drain_waiters:
+            waiter = self.drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def drain(self):
+        '''Waits until the transport's write buffer is below its high water
+        mark.'''
+        if self.writing_paused and not self.lost.done():
+            waiter = self.loop.create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
+
+    def check_open(self):
+        if (self.conn is None or self.conn.state is not CStates.OPEN or
+                self.lost.done()):
+            raise NnwsConnectionClosed(self.close_code or 1006,
+                                       self.close_reason)
+
+    def flush(self):
+        '''Writes out the frames queued in the Connection, unless a file is
+        being sent.'''
+        if not self.sending_file:
+            data = self.conn.data_to_send()
+            if data:
+                self.transport.write(data)
+
+    def write_frame(self, frame):
+        self.check_open()
+        if isinstance(frame, PreparedFrame):
+            self.transport.write(self.conn.send(frame))
+        else:
+            self.transport.writelines(self.conn.send_buffers(frame))
+
+    async def send(self, message):
+        '''Sends a message: a str as text, a bytes-like object as binary, or
+        a SendFrame, PreparedFrame or FileFrame as it is. The payload is
+        written without being copied, so a bytearray or memoryview sent
+        shouldn't be changed afterwards.
+
+        A str or bytes-like message longer than the Connection's
+        max_frame_size, or any other iterable or file-like object (sent as
+        binary), is sent in fragments, waiting for the transport between
+        each, so pings and pongs can go out in the middle of a large
+        message.'''
+        self.check_open()
+        if isinstance(message, FileFrame):
+            await self.send_file(message)
+            return
+        if isinstance(message, (SendFrame, PreparedFrame)):
+            frame = message
+        elif (isinstance(message, (str, bytes, bytearray, memoryview)) and
+                len(message) <= self.conn.max_frame_size):
+            frame = SendFrame(message,
+                              'text' if isinstance(message, str) else 'binary')
+        else:
+            await self.send_fragments(message)
+            return
+        if self.fragment_lock.locked():
+            async with self.fragment_lock:
+                self.write_frame(frame)
+        else:
+            self.write_frame(frame)
+        await self.drain()
+
+    async def send_fragments(self, message, f_type=None):
+        if f_type is None:
+            f_type = 'text' if isinstance(message, str) else 'binary'
+        async with self.fragment_lock:
+            self.check_open()
+            try:
+                for data in self.conn.send_fragments(message, f_type):
+                    self.transport.write(data)
+                    await self.drain()
+                    if self.lost.done():
+                        self.check_open()
+            except NnwsProtocolError:
+                # The closing handshake started part way through.
+                self.check_open()
+                raise
+
+    async def send_file(self, frame):
+        '''Sends a FileFrame. Servers hand the file to loop.sendfile, so its
+        bytes are never read in to Python, falling back to writing it from
+        mmap where that isn't possible, such as over TLS. Clients must mask
+        the payload, so send it in fragments read from mmap.'''
+        if self.role == 'CLIENT':
+            await self.send_fragments(frame.view(), frame.f_type)
+            return
+        async with self.fragment_lock:
+            self.check_open()
+            header, file, offset, length = self.conn.send_file(frame)
+            self.transport.write(header)
+            self.sending_file = True
+            try:
+                try:
+                    await self.loop.sendfile(self.transport, file, offset,
+                                             length, fallback=False)
+                except asyncio.SendfileNotAvailableError:
+                    view = frame.view()
+                    step = self.conn.max_frame_size
+                    for start in range(0, length, step):
+                        self.transport.write(view[start:start + step])
+                        await self.drain()
+                        if self.lost.done():
+                            self.check_open()
+            finally:
+                self.sending_file = False
+            self.flush()
+
+    async def ping(self, data=b''):
+        self.check_open()
+        self.conn.write(SendFrame(data, 'ping'))
+        self.flush()
+        await self.drain()
+
+    async def close(self, code=1000, reason=''):
+        '''Starts the closing handshake, if it hasn't already been, and
+        waits for the connection to close, aborting it if that takes longer
+        than close_timeout.'''
+        if self.conn is not None and self.conn.state is CStates.OPEN:
+            self.conn.write(SendFrame(reason, 'close', status_code=code))
+            self.flush()
+        elif self.conn is None:
+            self.transport.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.lost),
+                                   self.close_timeout)
+        except asyncio.TimeoutError:
+            self.transport.abort()
+
+    # Keepalive.
+
+    def schedule_tick(self):
+        '''Sets the timer for the Connection's next deadline, moving it if
+        the deadline has changed, such as when a pong arrives.'''
+        deadline = self.conn.next_deadline()
+        if self.timer is not None:
+            if deadline == self.timer.when():
+                return
+            self.timer.cancel()
+            self.timer = None
+        if deadline is not None:
+            self.timer = self.loop.call_at(deadline, self.tick)
+
+    def tick(self):
+        self.timer = None
+        result = self.conn.tick()
+        if result is Information.SEND_PING:
+            self.flush()
+        elif result is Information.CONNECTION_CLOSED:
+            self.transport.abort()
+            return
+        self.schedule_tick()
+
+
+def host_and_port(uri):
+    parsed = urlparse(uri)
+    secure = parsed.scheme.lower() == 'wss'
+    return parsed.hostname, parsed.port or (443 if secure else 80), secure
+
+
+async def connect(uri, *, ssl=None, **kwargs):
+    '''Connects to a websocket server, doing the opening handshake, and
+    returns the WebSocket. ssl is as for loop.create_connection, and is
+    turned on for wss:// addresses if not given. The rest of the keyword
+    arguments are passed on to WebSocket.'''
+    loop = asyncio.get_running_loop()
+    host, port, secure = host_and_port(uri)
+    if ssl is None and secure:
+        ssl = True
+    _, websocket = await loop.create_connection(
+        lambda: WebSocket('CLIENT', uri, **kwargs), host, port, ssl=ssl)
+    return await websocket.opened
+
+
+async def serve(handler, host=None, port=None, *, ssl=None, **kwargs):
+    '''Starts a websocket server, returning the asyncio.Server. handler is
+    called with each WebSocket once its opening handshake is done, and the
+    websocket is closed when it returns. The rest of the keyword arguments
+    are passed on to WebSocket.'''
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: WebSocket('SERVER', handler=handler, **kwargs),
+        host, port, ssl=ssl)
@@ -0,0 +1,74 @@
+'''Batching of small outgoing frames.
+
+Writing every frame to the socket as it is sent costs a system call per
+frame. A FrameBatcher instead queues frames up on the Connection and
+writes them out together, once enough bytes have built up or the oldest
+queued frame has waited long enough::
+
+    batcher = FrameBatcher(ws_conn, sock.sendall)
+    for update in updates:
+        batcher.send(ws.SendFrame(update, 'text'))
+    # When batcher.deadline() comes round:
+    batcher.tick()
+
+Frames that shouldn't wait can be sent with flush=True, or flush can be
+called directly. Like the Connection, the batcher sets no timers of its
+own: deadline says when tick next needs calling, and it can be scheduled on
+a TimerWheel or with loop.call_at.'''
+
+
+__all__ = ['FrameBatcher']
+
+
+class FrameBatcher:
+    '''Batches the frames sent on `conn`, handing them to `write` (such as
+    sock.sendall or transport.write) as one bytes object once `max_bytes`
+    are queued, or `max_delay` seconds after the first of them was. Times
+    come from the Connection's clock.'''
+    def __init__(self, conn, write, max_bytes=65536, max_delay=0.005):
+        self.conn = conn
+        self.write = write
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        # When the oldest frame in the batch was queued.
+        self.since = None
+
+    def __len__(self):
+        return len(self.conn.sendr)
+
+    def send(self, frame, flush=False):
+        '''Queues frame, writing out the batch if it has grown past
+        max_bytes, or straight away if flush is set. Returns the
+        Connection.write result.'''
+        result = self.conn.write(frame)
+        if self.since is None:
+            self.since = self.conn.clock()
+        if flush or len(self) >= self.max_bytes:
+            self.flush()
+        return result
+
+    def flush(self):
+        '''Writes out everything queued, in one go.'''
+        self.since = None
+        data = self.conn.data_to_send()
+        if data:
+            self.write(data)
+
+    def deadline(self):
+        '''When the batch must be written out by, or None if it's empty.'''
+        if self.since is None:
+            if not len(self):
+                return None
+            # Queued by the Connection its self, such as a pong.
+            self.since = self.conn.clock()
+        return self.since + self.max_delay
+
+    def tick(self, now=None):
+        '''Writes out the batch if its deadline has passed.'''
+        deadline = self.deadline()
+        if deadline is None:
+            return
+        if now is None:
+            now = self.conn.clock()
+        if now >= deadline:
+            self.flush()
@@ -1,7 +1,14 @@
-from .errors import NnwsProtocolError
+from codecs import getincrementaldecoder
+from time import monotonic, monotonic_ns
+from collections import deque
+from random import getrandbits
+
+from .errors import (NnwsProtocolError, NnwsInvalidPayloadError,
+                     NnwsMessageTooBigError)
 from .structs import *
+from .structs import bytesify
 from .constants import *
-from .handshake_utils import mask_unmask
+from .masking import mask_unmask, mask_regions
 
 __all__ = ['Connection']
 
@@ -14,7 +21,21 @@ class Connection:
                  opcode_non_control_mod=None,
                  opcode_control_mod=None,
                  max_buffer=9223372036854775807,
-                 full_message=False):
+                 full_message=False,
+                 stream=False,
+                 decode_text=False,
+                 deflate=None,
+                 max_inflated=None,
+                 timestamps=True,
+                 auto_pong=False,
+                 keepalive=None,
+                 close_timeout=None,
+                 clock=monotonic,
+                 high_water=None,
+                 low_water=None,
+                 max_frame_size=65536,
+                 spill_threshold=None,
+                 max_spill=None):
         if role == 'CLIENT':
             self.role = Roles.CLIENT
         elif role == 'SERVER':
@@ -37,116 +58,450 @@ class Connection:
                 if not (2 < opcode < 8):
                     raise ValueError('Opcode out of non-control frame range:',
                                      opcode)
-            global TYPE_FRAMES
-            TYPE_FRAMES.extend([opphrase for _, opphrase in
-                                opcode_non_control_mod.items()])
             self.opcodes.update(opcode_non_control_mod)
         if opcode_control_mod:
             for opcode in opcode_control_mod:
                 if not (10 < opcode < 16):
                     raise ValueError('Opcode out of control frame range:',
                                      opcode)
-            global CONTROL_FRAMES
-            CONTROL_FRAMES.extend([opphrase for _, opphrase in
-                                   opcode_control_mod.items()])
             self.opcodes.update(opcode_control_mod)
 
-        self.recvr = Recvr(self.role, self.opcodes, max_buffer, full_message)
-        self.event = None
+        self.optable = OpcodeTable.shared(self.opcodes)
+        self.deflate = deflate
+        self.max_inflated = max_inflated
+        if max_inflated is None:
+            max_inflated = max_buffer if spill_threshold is None else max_spill
+        if spill_threshold is not None and not full_message:
+            raise ValueError('spill_threshold needs full_message')
+        self.recvr = Recvr(self.role, self.optable, max_buffer, full_message,
+                           stream, decode_text, deflate, max_inflated,
+                           timestamps, spill_threshold, max_spill)
+        self.event_queue = deque()
+
+        self.auto_pong = auto_pong
+        self.clock = clock
+        self.keepalive = keepalive
+        if keepalive is not None:
+            keepalive.start(clock())
+        # How long the closing handshake may take, and when it runs out.
+        self.close_timeout = close_timeout
+        self.close_deadline = None
+        # Frames queued with write, along with those the connection sends
+        # of its own accord, such as pongs and keepalive pings.
+        self.sendr = Sendr(high_water, low_water)
+        # The largest payload send_fragments puts in one frame.
+        self.max_frame_size = max_frame_size
+        # Set while send_fragments is part way through a message.
+        self.fragmenting = False
 
     def recv(self, bytechunk):
-        '''Bytes from the network are passed in for processing in to events.'''
+        '''Bytes from the network are passed in for processing in to events.
+        Every complete frame in the bytes is parsed, and the resulting events
+        are queued up for next_event / events.'''
+        if self.state is CStates.CLOSED:
+            raise NnwsProtocolError('Trying to recv data on closed connection')
         event = self.recvr(bytechunk)
+        while event is not Information.NEED_DATA:
+            self._handle_event(event)
+            if self.state is CStates.CLOSED:
+                break
+            event = self.recvr(None)
+
+    def get_buffer(self, sizehint=-1):
+        '''Returns a writable memoryview in to the receiver's own buffer of at
+        least sizehint bytes, for use with socket.recv_into and the like.
+        Once data has been written in to it, call buffer_updated.'''
+        return self.recvr.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        '''Commits nbytes written in to the memoryview from get_buffer, and
+        processes them in to events just as recv would.'''
+        self.recvr.buffer_updated(nbytes)
+        self.recv(None)
+
+    def _handle_event(self, event):
+        '''Queues up a single parsed event, moving the connection's state
+        along if it is a close frame.'''
+        if not isinstance(event, BaseFrame):
+            return
         if self.state is CStates.OPEN:
-            if isinstance(event, BaseFrame):
-                self.event = event
-                if self.event.f_type == 'close':
-                    if self.close_init_client:
-                        self.state = CStates.CLOSED
-                    else:
-                        self.close_init_server = True
-                        self.state = CStates.CLOSING
+            self.event_queue.append(event)
+            if event.f_type == 'ping':
+                if self.auto_pong:
+                    self.sendr.write(self.send(SendFrame(event.payload,
+                                                         'pong')))
+            elif event.f_type == 'pong':
+                if self.keepalive is not None:
+                    self.keepalive.pong(event.payload, self.clock())
+            elif event.f_type == 'close':
+                if self.close_init_client:
+                    self.state = CStates.CLOSED
+                else:
+                    self.close_init_server = True
+                    self.closing()
 
         elif self.state is CStates.CLOSING:
             if self.close_init_client:
-                if isinstance(event, BaseFrame):
-                    self.event = event
-            elif self.close_init_server:
-                self.event = Information.SEND_CLOSE
-
-        else:  # self.state is CStates.CLOSED:
-            raise NnwsProtocolError('Trying to recv data on closed connection')
+                self.event_queue.append(event)
+                if event.f_type == 'close':
+                    self.state = CStates.CLOSED
 
     def send(self, frame):
         '''SendFrame objects are passed in, converted in to bytes and then
-        returned as bytes ready for transport over network.'''
-        assert isinstance(frame, SendFrame)
-        if self.state is CStates.OPEN:
-            byteball, close = frame(self.role, self.opcodes)
-            if close:
-                if self.close_init_server:
-                    self.state = CStates.CLOSED
-                else:
-                    self.close_init_client = True
-                    self.state = CStates.CLOSING
-        elif self.state is CStates.CLOSING:
-            byteball, close = frame(self.role, self.opcodes)
-            if not close:
-                raise NnwsProtocolError('Cannot send non-close frame in '
-                                        'closing state')
-        else:  # self.state is CStates.CLOSED:
+        returned as bytes ready for transport over network. PreparedFrames
+        may also be passed in by servers, and FileFrames by anyone.'''
+        assert isinstance(frame, (SendFrame, PreparedFrame, FileFrame))
+        self._check_fragmenting(frame)
+        return self._encode(frame.__call__)
+
+    def prepare(self, frame):
+        '''Wraps a SendFrame in a PreparedFrame, which caches its encoded
+        bytes for sending the same message to many connections.'''
+        return PreparedFrame(frame)
+
+    def send_buffers(self, frame):
+        '''Like send, but returns the frame as a (header, payload) tuple of
+        buffers suitable for socket.sendmsg or transport.writelines. For
+        unmasked frames the payload is a memoryview of the SendFrame's data,
+        so it is never copied. A FileFrame's unmasked payload is a view of
+        its mapped file.'''
+        assert isinstance(frame, (SendFrame, FileFrame))
+        self._check_fragmenting(frame)
+        return self._encode(frame.buffers)
+
+    def send_file(self, frame):
+        '''Encodes a FileFrame for os.sendfile, returning its header and the
+        (file, offset, length) of its payload, as a tuple. The header is
+        sent first, then the file's bytes as they are. Servers only.'''
+        assert isinstance(frame, FileFrame)
+        self._check_fragmenting(frame)
+        return self._encode(frame.file_range)
+
+    def closing(self):
+        '''Moves in to the CLOSING state, starting the close_timeout.'''
+        self.state = CStates.CLOSING
+        if self.close_timeout is not None:
+            self.close_deadline = self.clock() + self.close_timeout
+
+    def _check_fragmenting(self, frame):
+        '''Refuses a data frame while send_fragments has a message open, as
+        it would land in the middle of that message.'''
+        if not self.fragmenting:
+            return
+        if isinstance(frame, PreparedFrame):
+            frame = frame.frame
+        f_type = frame[1] if isinstance(frame, tuple) else frame.f_type
+        if f_type not in self.optable.control_frames:
+            raise NnwsProtocolError('Cannot send a data frame in the middle '
+                                    'of a fragmented message:', f_type)
+
+    def _encode(self, encoder):
+        if self.state is CStates.CLOSED:
             raise NnwsProtocolError('Trying to send data on closed connection')
+        byteball, close = encoder(self.role, self.optable, self.deflate)
+        if close:
+            self._sent_close()
+        elif self.state is CStates.CLOSING:
+            raise NnwsProtocolError('Cannot send non-close frame in '
+                                    'closing state')
+        return byteball
 
+    def _sent_close(self):
+        '''Moves the state along for a close frame being sent, either
+        answering the other side's close or starting the closing
+        handshake.'''
+        if self.close_init_server:
+            self.state = CStates.CLOSED
+        elif not self.close_init_client:
+            self.close_init_client = True
+            self.closing()
+
+    def send_many(self, frames):
+        '''Encodes many frames in to one bytearray, ready to be sent in a
+        single write. frames is an iterable of SendFrames, PreparedFrames
+        or (data, f_type) tuples. Every frame's header is worked out first,
+        so the output is allocated once at its exact size, and the
+        connection's state is only checked once. A close frame may only
+        come last.'''
+        if self.state is CStates.CLOSED:
+            raise NnwsProtocolError('Trying to send data on closed connection')
+        optable = self.optable
+        masked = self.role is Roles.CLIENT
+        # Plain (data, f_type) tuples skip building a SendFrame, unless
+        # they need compressing or are closes.
+        plain = self.deflate is None and self.state is CStates.OPEN
+        pieces = []
+        masks = []
+        size = 0
+        close = False
+        for frame in frames:
+            if close:
+                raise NnwsProtocolError('Cannot send frames after a close '
+                                        'frame')
+            if self.fragmenting:
+                self._check_fragmenting(frame)
+            if isinstance(frame, PreparedFrame):
+                encoded, close = frame(self.role, optable, self.deflate)
+                if not close and self.state is CStates.CLOSING:
+                    raise NnwsProtocolError('Cannot send non-close frame in '
+                                            'closing state')
+                pieces.append(encoded)
+                size += len(encoded)
+                continue
+            if (plain and type(frame) is tuple and len(frame) == 2 and
+                    frame[1] != 'close'):
+                data, f_type = frame
+                data = bytesify(data)
+                try:
+                    opcode = optable.numbers[f_type]
+                except KeyError:
+                    raise NnwsProtocolError('Unknown frame type:', f_type)
+                if opcode & 0b1000 and len(data) > 125:
+                    raise NnwsProtocolError('Payload too big for control '
+                                            'frame.')
+                header = optable.header(0b10000000 | opcode, len(data),
+                                        masked)
+                if masked:
+                    mask = getrandbits(32).to_bytes(4, 'big')
+                    header += mask
+                else:
+                    mask = None
+            else:
+                if not isinstance(frame, SendFrame):
+                    frame = SendFrame(*frame)
+                data, header, mask, close = frame.prepare(
+                    self.role, optable, self.deflate)
+                if not close and self.state is CStates.CLOSING:
+                    raise NnwsProtocolError('Cannot send non-close frame in '
+                                            'closing state')
+            if mask is not None:
+                masks.append((size + len(header), len(data), mask))
+            pieces.append(header)
+            pieces.append(data)
+            size += len(header) + len(data)
+
+        # join works out the total size and allocates once.
+        byteball = bytearray().join(pieces)
+        if masks:
+            mask_regions(byteball, masks)
+        if close:
+            self._sent_close()
         return byteball
 
+    def send_fragments(self, data, f_type='binary', compress=True,
+                       max_frame_size=None):
+        '''Sends one message as a series of frames with payloads of at most
+        max_frame_size bytes (the connection's max_frame_size by default),
+        lazily yielding each encoded frame in turn. data may be a str or
+        bytes-like object, an iterable of them, or a file-like object with a
+        read method, so a large message never needs to be held whole in
+        memory. Control frames, such as pings, may be sent between the
+        fragments; sending any other data frame before the last fragment has
+        been yielded raises NnwsProtocolError. A message abandoned part way
+        is never finished, so leaves the connection unable to send data.'''
+        if max_frame_size is None:
+            max_frame_size = self.max_frame_size
+        if max_frame_size < 1:
+            raise ValueError('Invalid max_frame_size:', max_frame_size)
+        if f_type not in self.optable.type_frames:
+            raise NnwsProtocolError('Only data frames can be fragmented:',
+                                    f_type)
+        if self.fragmenting:
+            raise NnwsProtocolError('Already sending a fragmented message.')
+        pieces = split_payload(data, max_frame_size)
+        piece = next(pieces)
+        # The fragments themselves skip the check in send.
+        self.fragmenting = True
+        for next_piece in pieces:
+            yield self._encode(SendFrame(piece, f_type, False,
+                                         compress=compress).__call__)
+            f_type = 'continue'
+            piece = next_piece
+        last = self._encode(SendFrame(piece, f_type,
+                                      compress=compress).__call__)
+        self.fragmenting = False
+        yield last
+
+    def write(self, frame):
+        '''Like send, but rather than being returned the frame's bytes are
+        queued up, along with any pongs from auto_pong and pings from tick,
+        to be taken with bytes_to_send or data_to_send. Returns
+        Information.WRITE_BLOCKED while more than high_water bytes are
+        queued, until they have been sent down to low_water. The frame is
+        queued either way.'''
+        assert isinstance(frame, (SendFrame, PreparedFrame))
+        self._check_fragmenting(frame)
+        return self.sendr.write(self._encode(frame.__call__))
+
+    def bytes_to_send(self, max_bytes=None):
+        '''Returns a memoryview of the queued bytes, up to max_bytes, as one
+        contiguous buffer for a single socket.send. It is only valid until
+        the next call in to the connection. Call data_sent with however
+        much of it was sent.'''
+        return self.sendr.peek(max_bytes)
+
+    def data_sent(self, nbytes):
+        '''Removes nbytes from the front of the queue, once sent.'''
+        self.sendr.consume(nbytes)
+
+    def data_to_send(self):
+        '''Returns all of the queued bytes, emptying the queue.'''
+        return self.sendr.take()
+
+    @property
+    def write_blocked(self):
+        '''True from when more than high_water bytes are queued until no
+        more than low_water are.'''
+        return self.sendr.blocked
+
+    def tick(self, now=None):
+        '''Drives the keepalive and close_timeout. Called at (or after)
+        next_deadline with the current time from the connection's clock,
+        which is read if now isn't given.
+
+        Returns:
+            Information.SEND_PING - when a ping has been made, ready to be
+                sent from data_to_send.
+            Information.CONNECTION_CLOSED - when the last ping's pong, or the
+                other side's close frame, didn't arrive in time. The
+                connection is then closed, and should be dropped.
+            None - when there is nothing to do.'''
+        if now is None:
+            now = self.clock()
+        if self.state is CStates.CLOSING:
+            if self.close_deadline is not None and now >= self.close_deadline:
+                self.state = CStates.CLOSED
+                return Information.CONNECTION_CLOSED
+            return None
+        if self.keepalive is None or self.state is not CStates.OPEN:
+            return None
+        result = self.keepalive.tick(now)
+        if result is Information.SEND_PING:
+            self.sendr.write(self.send(SendFrame(self.keepalive.awaiting,
+                                                 'ping')))
+        elif result is Information.CONNECTION_CLOSED:
+            self.state = CStates.CLOSED
+        return result
+
+    def next_deadline(self):
+        '''When tick next needs to be called, or None if never.'''
+        if self.state is CStates.CLOSING:
+            return self.close_deadline
+        if self.keepalive is None or self.state is not CStates.OPEN:
+            return None
+        return self.keepalive.deadline
+
+    @property
+    def rtt(self):
+        '''The round trip time of the latest keepalive ping, in seconds, or
+        None before one has been answered.'''
+        if self.keepalive is None:
+            return None
+        return self.keepalive.rtt
+
     def next_event(self):
         '''Checks to see if there is a ReceivedFrame, Message or ControlFrame
         ready and returns them. If there is not, returns Information.NEED_DATA
         indicating more data from the network is required to construct an
         event.'''
+        if self.event_queue:
+            return self.event_queue.popleft()
         if self.state is CStates.OPEN:
-            if self.event is not None:
-                returnable = self.event
-                self.event = None
-            else:
-                returnable = Information.NEED_DATA
+            returnable = Information.NEED_DATA
         elif self.state is CStates.CLOSING:
-            if self.event is not None:
-                returnable = self.event
-                self.event = None
-            else:
-                if self.close_init_client:
-                    returnable = Information.NEED_DATA
-                if self.close_init_server:
-                    returnable = Information.SEND_CLOSE
+            if self.close_init_client:
+                returnable = Information.NEED_DATA
+            if self.close_init_server:
+                returnable = Information.SEND_CLOSE
         else:  # self.state is CStates.CLOSED:
             raise NnwsProtocolError('Trying to recv data on closed connection')
         return returnable
 
+    def events(self):
+        '''Yields every event currently queued up, stopping once more data
+        from the network is required.'''
+        while self.event_queue:
+            yield self.event_queue.popleft()
+
 
 class Recvr:
     '''A class the implements the parsing of network data in to the relevant
-    frame type.'''
-    def __init__(self, role, opcodes, max_buffer, full_message):
+    frame type.
+
+    Incoming bytes are written in to a single growable buffer. self.start
+    is the offset of the first byte not yet consumed (the start of the frame
+    currently being parsed) and self.end is the offset just past the last
+    byte written. Frames are parsed in place using offsets relative to
+    self.start, so no matter how many pieces a frame arrives in, each byte
+    is only copied in once and out once.'''
+    # Once at least this much of the buffer has been consumed, it is shifted
+    # down to make room rather than the buffer being grown.
+    COMPACT_THRESHOLD = 65536
+    # An idle buffer larger than this is dropped rather than kept around.
+    IDLE_BUFFER_MAX = 1048576
+    # How much room get_buffer makes when the caller has no size in mind.
+    DEFAULT_READ_SIZE = 65536
+
+    def __init__(self, role, optable, max_buffer, full_message,
+                 stream=False, decode_text=False, deflate=None,
+                 max_inflated=None, timestamps=True, spill_threshold=None,
+                 max_spill=None):
         self.data_f = None
         self.f = None
+        # The parser is reset and reused for every frame. The first frame of
+        # a fragmented message is held on to as data_f, so while it is, the
+        # spare parser takes its place.
+        self.parser = FrameParser(optable)
+        self.spare = None
 
         self.latest_data_frame_type = None
 
         self.buffer = bytearray()
+        self.start = 0
+        self.end = 0
+        self.view = None
         try:
             assert max_buffer > 125
             self.max_buffer = max_buffer
         except AssertionError:
             raise ValueError('max_buffer must be > 125')
+        # Messages bigger than spill_threshold are assembled in a temporary
+        # file, so only each frame has to fit in max_buffer. Whole messages
+        # are then limited by max_spill instead.
+        self.spill_threshold = spill_threshold
+        if spill_threshold is None:
+            self.max_frame_inflated = None
+            self.max_message = max_buffer
+        else:
+            # Each frame is still inflated whole in to memory before it can
+            # be spilled, so max_buffer limits that too.
+            self.max_frame_inflated = max_buffer
+            if max_spill is None:
+                self.max_message = 9223372036854775807
+            else:
+                self.max_message = max_spill
 
         self.state = RecvrState.AWAIT_FRAME_START
         self.role = role
-        self.opcodes = opcodes
+        self.optable = optable
+        self.type_frames = optable.type_frames
+        self.control_frames = optable.control_frames
 
         self.full_message = full_message
         self.partial_message_signal = False
 
+        self.stream = stream
+        self.stream_type = None
+
+        self.utf8 = getincrementaldecoder('utf-8')()
+        self.decode_text = decode_text
+        self.message_text = []
+
+        self.deflate = deflate
+        self.max_inflated = max_inflated
+
+        self.timestamp = monotonic_ns if timestamps else no_timestamp
+
     def __call__(self, bytechunk):
         '''Bytes are passed in and processed in to frames here, dependent on
         the current state of self.
@@ -171,69 +526,150 @@ class Recvr:
         Returns:
             Information.NEED_DATA - when not enough bytes for a full frame have
                 been passed from the network.
+            None - when a frame was consumed but produced no event, such as
+                a non-final fragment while full messages are requested.
             ReceivedFrame - when frames are requested as events, and any non-
                 control frame has been fully processed.
             Message - when full messages are requested as events and any non-
                 control frame has been fully processed.
-            ControlFrame - when any control frame has been processed.'''
+            ControlFrame - when any control frame has been processed.
+            PayloadChunk - when streaming, for every piece of a non-control
+                frame's payload as it arrives.'''
+        if bytechunk:
+            self.feed(bytechunk)
+
         if self.state is RecvrState.AWAIT_FRAME_START:
-            if bytechunk:
-                self.buffer.extend(bytechunk)
-                bytechunk = None
             result = self.await_start()
             if result is not None:
                 return result
-            self.buffer = bytearray()
 
         if self.state is RecvrState.NEED_LEN:
-            result = self.need_len(bytechunk)
+            result = self.need_len()
             if result is not None:
                 return result
 
         if self.state is RecvrState.NEED_MASK:
-            result = self.need_mask(bytechunk)
+            result = self.need_mask()
             if result is not None:
                 return result
 
         if self.state is RecvrState.NEED_BODY:
-            result = self.need_body(bytechunk)
+            result = self.need_body()
             if result is not None:
                 return result
 
         if self.state is RecvrState.MSG_RECVD:
             return self.msg_recvd()
 
+    def feed(self, bytechunk):
+        '''Copies bytes from the network on to the end of the buffer.'''
+        size = len(bytechunk)
+        self.reserve(size)
+        self.buffer[self.end:self.end + size] = bytechunk
+        self.end += size
+
+    def get_buffer(self, sizehint):
+        '''Hands out a writable view of the free space past self.end, which
+        has room for at least sizehint bytes.'''
+        if sizehint <= 0:
+            sizehint = self.DEFAULT_READ_SIZE
+        self.reserve(sizehint)
+        self.view = memoryview(self.buffer)[self.end:]
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        '''Commits nbytes written in to the view from get_buffer.'''
+        if self.view is None:
+            raise NnwsProtocolError('buffer_updated called without get_buffer')
+        if nbytes > len(self.view):
+            raise ValueError('nbytes larger than the buffer handed out')
+        self.release_view()
+        self.end += nbytes
+
+    def release_view(self):
+        '''A bytearray can't be resized while it is exported, so the view
+        from get_buffer is released before the buffer is touched again.'''
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+
+    def reserve(self, size):
+        '''Makes sure there is room for at least size bytes past self.end,
+        compacting the buffer if enough of it has been consumed, and
+        otherwise doubling it.'''
+        self.release_view()
+        if self.end + size <= len(self.buffer):
+            return
+        if (self.start >= self.COMPACT_THRESHOLD or
+                self.start >= self.end - self.start):
+            self.compact()
+        shortfall = self.end + size - len(self.buffer)
+        if shortfall > 0:
+            self.buffer.extend(bytes(max(shortfall, len(self.buffer))))
+
+    def consume(self, size):
+        '''Marks size bytes at the start of the buffer as consumed.'''
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > self.IDLE_BUFFER_MAX:
+                self.buffer = bytearray()
+
+    def compact(self):
+        '''Drops the consumed prefix of the buffer.'''
+        del self.buffer[:self.start]
+        self.end -= self.start
+        self.start = 0
+
+    @property
+    def buffered(self):
+        '''The number of bytes received but not yet consumed.'''
+        return self.end - self.start
+
     def await_start(self):
-        if len(self.buffer) < 2:
+        if self.buffered < 2:
             return Information.NEED_DATA
-        self.f = FrameParser(self.buffer, self.opcodes)
-        self.f.proc(self.role)
+        self.f = self.parser
+        self.f.reset()
+        self.f.proc(self.role, self.buffer, self.start)
         if self.latest_data_frame_type is None:
-            if self.f.opcode in TYPE_FRAMES:
+            if self.f.opcode in self.type_frames:
                 self.latest_data_frame_type = self.f.opcode
 
         if self.f.l_bound:
             self.state = RecvrState.NEED_LEN
-        elif self.f.masked:
+            return
+        # The length is already known, so is checked here, as need_len
+        # would otherwise.
+        self.check_size()
+        if self.f.masked:
             self.state = RecvrState.NEED_MASK
         else:
             self.state = RecvrState.NEED_BODY
 
-    def need_len(self, bytechunk):
-        if bytechunk is not None:
-            self.f.buffer.extend(bytechunk)
-        if len(self.f.buffer) < 2 + self.f.l_bound:
-            return Information.NEED_DATA
-        self.f.expected_len = int.from_bytes(
-            self.f.buffer[2:self.f.l_bound], 'big')
-
-        if self.f.opcode in TYPE_FRAMES or self.f.opcode == 'continue':
+    def check_size(self):
+        '''Fails the frame as soon as its length is known if it, or the
+        message it belongs to, would be too big.'''
+        if self.f.opcode in self.control_frames:
+            # Already held to 125 bytes by FrameParser.proc.
+            pass
+        elif self.stream:
+            # Streamed payloads are never buffered whole, so aren't limited.
+            pass
+        else:
             if self.data_f is not None:
-                if (len(self.data_f.buffer) + self.f.expected_len >
-                        self.max_buffer):
-                    raise NnwsProtocolError('Message Too Big')
-        if self.f.expected_len > self.max_buffer:
-            raise NnwsProtocolError('Message Too Big')
+                if (self.data_f.message_size + self.f.expected_len >
+                        self.max_message):
+                    raise NnwsMessageTooBigError('Message Too Big')
+            if self.f.expected_len > self.max_buffer:
+                raise NnwsMessageTooBigError('Message Too Big')
+
+    def need_len(self):
+        if self.buffered < self.f.l_bound:
+            return Information.NEED_DATA
+        self.f.expected_len, = EXTENDED_LEN[self.f.l_bound](
+            self.buffer, self.start + 2)
+        self.check_size()
 
         if self.f.masked:
             self.state = RecvrState.NEED_MASK
@@ -241,47 +677,95 @@ class Recvr:
             self.f.pl_strt = self.f.l_bound
             self.state = RecvrState.NEED_BODY
 
-    def need_mask(self, bytechunk):
-        if bytechunk is not None:
-            self.f.buffer.extend(bytechunk)
-        if self.f.l_bound:
-            if len(self.f.buffer) < 6 + self.f.l_bound:
-                return Information.NEED_DATA
-            self.mask = self.f.buffer[2+self.f.l_bound:6+self.f.l_bound]
-            self.f.pl_strt = 7 + self.f.l_bound
-        else:
-            if len(self.f.buffer) < 7:
-                return Information.NEED_DATA
-            self.f.mask = self.f.buffer[2:6]
-            self.f.pl_strt = 6
+    def need_mask(self):
+        mask_strt = self.f.l_bound or 2
+        if self.buffered < mask_strt + 4:
+            return Information.NEED_DATA
+        mask_strt += self.start
+        self.f.mask = bytes(self.buffer[mask_strt:mask_strt + 4])
+        self.f.pl_strt = mask_strt + 4 - self.start
         self.state = RecvrState.NEED_BODY
 
-    def need_body(self, bytechunk):
-        if bytechunk is not None:
-            self.f.buffer.extend(bytechunk)
-        if len(self.f.buffer[self.f.pl_strt:]) < self.f.expected_len:
-            return Information.NEED_DATA
+    def need_body(self):
+        if self.stream and self.f.opcode not in self.control_frames:
+            return self.stream_body()
         self.f.raw_len = self.f.pl_strt + self.f.expected_len
-        if not self.f.masked:
-            self.f.payload.extend(self.f.buffer[self.f.pl_strt:self.f.raw_len])
-        else:
-            self.f.payload.extend(
-                mask_unmask(
-                    self.f.buffer[self.f.pl_strt:self.f.raw_len], self.f.mask))
+        if self.buffered < self.f.raw_len:
+            return Information.NEED_DATA
+        pl_strt = self.start + self.f.pl_strt
+        self.f.payload = self.buffer[pl_strt:pl_strt + self.f.expected_len]
+        if self.f.masked:
+            mask_unmask(self.f.payload, self.f.mask)
         self.state = RecvrState.MSG_RECVD
 
+    def stream_body(self):
+        '''Hands out whatever part of the current frame's payload has
+        arrived so far as a PayloadChunk, without waiting for the rest.'''
+        first = False
+        if self.f.pl_strt:
+            # First call for this frame, so drop the header.
+            if self.f.opcode == 'continue':
+                if self.stream_type is None:
+                    raise NnwsProtocolError('Continuation frame with no '
+                                            'message to continue.')
+            elif self.stream_type is not None:
+                raise NnwsProtocolError('Attempted to interleave '
+                                        'non-control frames.')
+            else:
+                self.stream_type = self.f.opcode
+                first = True
+            self.consume(self.f.pl_strt)
+            self.f.pl_strt = 0
+
+        remaining = self.f.expected_len - self.f.received
+        size = min(self.buffered, remaining)
+        if not size and remaining:
+            return Information.NEED_DATA
+        chunk = self.buffer[self.start:self.start + size]
+        if self.f.masked:
+            mask_unmask(chunk, self.f.mask, self.f.received)
+        self.consume(size)
+        self.f.received += size
+
+        frame_fin = size == remaining
+        message_fin = frame_fin and self.f.fin
+        if self.deflate is not None:
+            chunk = self.deflate.incoming(chunk, first, self.f.rsv & 0b100,
+                                          message_fin, self.max_inflated)
+        returnable = PayloadChunk(frame_fin, message_fin, chunk,
+                                  self.stream_type, self.f.rsv,
+                                  self.timestamp())
+        returnable.decoded_text = self.check_text(
+            self.stream_type, chunk, message_fin)
+        if frame_fin:
+            if message_fin:
+                self.stream_type = None
+            self.state = RecvrState.AWAIT_FRAME_START
+            self.f = None
+        return returnable
+
     def msg_recvd(self):
-        self.buffer = self.f.buffer[self.f.raw_len:]
-        if self.f.opcode in TYPE_FRAMES:
+        self.consume(self.f.raw_len)
+        if (self.deflate is not None and
+                self.f.opcode not in self.control_frames):
+            self.f.payload = self.deflate.incoming(
+                self.f.payload, self.f.opcode != 'continue',
+                self.f.rsv & 0b100, self.f.fin, self.max_inflated,
+                self.max_frame_inflated)
+        if self.f.opcode in self.type_frames:
             returnable = self.type_frame_body()
 
         elif self.f.opcode == 'continue':
             returnable = self.continue_body()
 
-        elif self.f.opcode in CONTROL_FRAMES:
+        elif self.f.opcode in self.control_frames:
             returnable = self.control_body()
 
         self.state = RecvrState.AWAIT_FRAME_START
+        # The payload has been handed off, so the reused parser shouldn't
+        # keep it alive.
+        if self.f is not self.data_f:
+            self.f.payload = None
         self.f = None
         if not self.full_message:
             if self.data_f:
@@ -291,64 +775,225 @@ class Recvr:
 
     def type_frame_body(self):
         if not self.data_f:
+            text = self.check_text(self.f.opcode, self.f.payload, self.f.fin)
             if self.f.fin:
                 if self.full_message:
-                    returnable = Message(
-                        self.f.payload, self.f.opcode, self.f.resrvd)
+                    returnable = Message(self.f.payload, self.f.opcode,
+                                         self.f.rsv, self.timestamp())
                 else:
                     returnable = ReceivedFrame(True,
                                                self.f.payload,
                                                self.f.opcode,
-                                               self.f.resrvd)
+                                               self.f.rsv,
+                                               self.timestamp())
+                returnable.decoded_text = text
             else:
                 self.data_f = self.f
+                self.data_f.hold()
+                self.swap_parser()
                 if not self.full_message:
                     returnable = ReceivedFrame(False,
                                                self.data_f.payload,
                                                self.data_f.opcode,
-                                               self.data_f.resrvd)
+                                               self.data_f.rsv,
+                                               self.timestamp())
+                    returnable.decoded_text = text
                 else:
-                    returnable = Information.NEED_DATA
+                    self.message_text.append(text)
+                    returnable = None
         else:
             self.f = None
             raise NnwsProtocolError('Attempted to interleave '
                                     'non-control frames.')
         return returnable
 
+    def swap_parser(self):
+        '''Swaps in the spare parser while the current one is held on to
+        as data_f. The message data_f held will have been delivered before
+        the next swap, so the two parsers simply alternate.'''
+        if self.spare is None:
+            self.spare = FrameParser(self.optable)
+        self.parser, self.spare = self.spare, self.parser
+
     def continue_body(self):
-        self.data_f.incorporate(self.f)
+        text = self.check_text(self.data_f.opcode, self.f.payload, self.f.fin)
+        self.data_f.incorporate(self.f, self.full_message,
+                                self.spill_threshold)
+        if self.data_f.spilled:
+            # The text is still checked, but not kept in memory.
+            text = None
+            self.message_text = []
         if not self.full_message:
             self.partial_message_signal = True
         if self.data_f.fin:
             self.latest_data_frame_type = None
             if self.full_message:
+                if self.data_f.spilled:
+                    self.data_f.payload.seek(0)
                 returnable = Message(self.data_f.payload,
                                      self.data_f.opcode,
-                                     self.data_f.resrvd)
+                                     self.data_f.rsv,
+                                     self.timestamp())
+                if text is not None:
+                    self.message_text.append(text)
+                    text = ''.join(self.message_text)
+                self.message_text = []
             else:
                 returnable = ReceivedFrame(True,
                                            self.data_f.payload,
                                            self.data_f.opcode,
-                                           self.data_f.resrvd)
+                                           self.data_f.rsv,
+                                           self.timestamp())
+            returnable.decoded_text = text
+            self.data_f.payload = None
             self.data_f = None
         else:
             if self.full_message:
-                returnable = Information.NEED_DATA
+                self.message_text.append(text)
+                returnable = None
             else:
                 returnable = ReceivedFrame(False,
                                            self.data_f.payload,
                                            self.data_f.opcode,
-                                           self.data_f.resrvd)
+                                           self.data_f.rsv,
+                                           self.timestamp())
+                returnable.decoded_text = text
         return returnable
 
-    def control_body(self):
-        if self.f.fin:
-                return ControlMessage(
-                    self.f.payload, self.f.opcode, self.f.resrvd)
+    def check_text(self, f_type, payload, final):
+        '''Runs each piece of a text message through an incremental UTF-8
+        decoder as it arrives, so that bad data fails the connection
+        straight away. Pure ASCII pieces that don't follow a partial
+        character skip the decoder. Returns the decoded text if
+        decode_text is set, otherwise None.'''
+        if f_type != 'text':
+            return None
+        if payload.isascii() and not self.utf8.getstate()[0]:
+            text = payload.decode('ascii') if self.decode_text else None
         else:
-            self.f = None
-            raise NnwsProtocolError('Fragmented control frame.')
+            try:
+                text = self.utf8.decode(payload, final)
+            except UnicodeDecodeError:
+                self.utf8.reset()
+                raise NnwsInvalidPayloadError('Invalid UTF-8 in text '
+                                              'message.')
+            if not self.decode_text:
+                text = None
+        if final:
+            self.utf8.reset()
+        return text
+
+    def control_body(self):
+        # Control frames are never fragmented, as FrameParser.proc checks.
+        return ControlMessage(self.f.payload, self.f.opcode, self.f.rsv,
+                              self.timestamp())
 
     def mod_buffer(self):
-        self.data_f.buffer = bytearray()
-        self.data_f.payload = bytearray()
+        '''Without full messages each frame is delivered as it arrives, so
+        the held frame only limits the size of the next one.'''
+        self.data_f.payload = None
+        self.data_f.message_size = 0
+
+
+class Sendr:
+    '''The outgoing byte queue. Frames are copied on to the end of a single
+    buffer, so that however many small frames are queued they can go out in
+    one write. self.start is the offset of the first byte not yet sent.'''
+    # Once at least this much of the buffer has been sent, and it makes up
+    # at least half of the buffer, it is dropped.
+    COMPACT_THRESHOLD = 65536
+
+    def __init__(self, high_water=None, low_water=None):
+        self.buffer = bytearray()
+        self.start = 0
+        self.view = None
+        if low_water is None and high_water is not None:
+            low_water = high_water // 4
+        if high_water is not None and low_water > high_water:
+            raise ValueError('low_water must be <= high_water')
+        self.high_water = high_water
+        self.low_water = low_water
+        self.blocked = False
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def write(self, data):
+        self.release_view()
+        self.buffer += data
+        if self.high_water is not None and len(self) > self.high_water:
+            self.blocked = True
+        if self.blocked:
+            return Information.WRITE_BLOCKED
+        return None
+
+    def peek(self, max_bytes=None):
+        self.release_view()
+        end = len(self.buffer)
+        if max_bytes is not None:
+            end = min(end, self.start + max_bytes)
+        self.view = memoryview(self.buffer)[self.start:end]
+        return self.view
+
+    def consume(self, nbytes):
+        self.release_view()
+        if nbytes > len(self):
+            raise ValueError('nbytes larger than the queued data')
+        self.start += nbytes
+        if self.start == len(self.buffer):
+            self.buffer = bytearray()
+            self.start = 0
+        elif (self.start >= self.COMPACT_THRESHOLD and
+                self.start >= len(self.buffer) - self.start):
+            del self.buffer[:self.start]
+            self.start = 0
+        if self.blocked and len(self) <= self.low_water:
+            self.blocked = False
+
+    def take(self):
+        data = bytes(memoryview(self.buffer)[self.start:])
+        self.consume(len(data))
+        return data
+
+    def release_view(self):
+        '''A bytearray can't be resized while it is exported, so the view
+        from peek is released before the buffer is touched again.'''
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+
+
+def split_payload(data, size):
+    '''Yields data in pieces of size bytes, the last of which may be
+    shorter. Always yields at least one piece, even if it is empty.'''
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = memoryview(data).cast('B')
+        cut = max(len(data) - 1, 0) // size * size
+        for start in range(0, cut, size):
+            yield data[start:start + size]
+        yield data[cut:]
+        return
+    if hasattr(data, 'read'):
+        read = data.read
+        data = iter(lambda: read(size), read(0))
+    pending = bytearray()
+    for chunk in data:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        pending += chunk
+        if len(pending) > size:
+            # Hold back at least one byte, so the last piece is never sent
+            # before it is known to be the last.
+            cut = (len(pending) - 1) // size * size
+            view = memoryview(pending)
+            for start in range(0, cut, size):
+                yield bytes(view[start:start + size])
+            view.release()
+            del pending[:cut]
+    yield pending
+
+
+def no_timestamp():
+    return None
@@ -9,16 +9,27 @@ __all__ = ['MAGIC_STR',
            'CStates',
            'Roles',
            'RecvrState',
-           'Information']
+           'Information',
+           'valid_close_code']
 
 MAGIC_STR = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
-CONTROL_FRAMES = ['close', 'ping', 'pong']
-TYPE_FRAMES = ['text', 'binary']
-CONT_FRAME = ['continue']
+# The base frame types. A connection's own, including any custom opcodes,
+# are on its OpcodeTable.
+CONTROL_FRAMES = ('close', 'ping', 'pong')
+TYPE_FRAMES = ('text', 'binary')
+CONT_FRAME = ('continue',)
 BASE_ALL_FRAMES = CONTROL_FRAMES + TYPE_FRAMES + CONT_FRAME
 
 
+def valid_close_code(code):
+    '''Whether code may be sent in a close frame (RFC 6455 7.4). 1004 is
+    reserved, and 1005, 1006 and 1015 only stand in for a missing code or
+    frame, so are never sent. 3000-4999 are for libraries, frameworks and
+    applications.'''
+    return 1000 <= code <= 1003 or 1007 <= code <= 1014 or 3000 <= code <= 4999
+
+
 class CStates(Enum):
     OPEN = auto()
     CLOSING = auto()
@@ -44,6 +55,7 @@ class Information(Enum):
     SEND_PONG = auto()
     SEND_CLOSE = auto()
     CONNECTION_CLOSED = auto()
+    WRITE_BLOCKED = auto()
 
 
 status_codes = {1000: 'Normal Closure',
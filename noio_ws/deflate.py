@@ -0,0 +1,296 @@
+'''The permessage-deflate extension, as per RFC 7692.
+
+A PerMessageDeflate object is made from the parameters agreed during the
+opening handshake and passed to the Connection, which then compresses
+outgoing messages and decompresses incoming ones, flagging compressed
+messages with the first reserved bit.'''
+import zlib
+
+from .constants import Roles
+from .errors import NnwsProtocolError, NnwsMessageTooBigError
+
+
+__all__ = ['PerMessageDeflate', 'CompressorPool', 'deflate_message']
+
+# Every compressed message ends with an empty stored block, which is left
+# off on the wire.
+TAIL = b'\x00\x00\xff\xff'
+
+# Decompressed output is pulled out of zlib at most this much at a time, so
+# that the size limit is checked before a compressed bomb is fully inflated.
+INFLATE_CHUNK = 65536
+
+# zlib can't compress with a 256 byte window, so 8 is never agreed to for
+# our own side.
+MIN_WINDOW_BITS = 9
+MAX_WINDOW_BITS = 15
+
+
+def window_bits(value, param):
+    '''Checks a *_max_window_bits value from a header. Bare parameters
+    (None) mean the default of 15.'''
+    if value is None:
+        return MAX_WINDOW_BITS
+    try:
+        bits = int(value)
+    except ValueError:
+        raise NnwsProtocolError('Bad value for {}:'.format(param), value)
+    if not 8 <= bits <= MAX_WINDOW_BITS:
+        raise NnwsProtocolError('Bad value for {}:'.format(param), value)
+    return bits
+
+
+class CompressorPool:
+    '''Compressors shared between connections, one per compression level
+    and window size.
+
+    A compressor is only borrowed to compress a whole message in one go,
+    and is then reset with a full flush, so no context carries over from
+    one message (or connection) to the next. That makes it only usable by
+    sides which agreed to *_no_context_takeover, but lets any number of
+    such connections share one compressor instead of each holding on to
+    their own.'''
+    def __init__(self):
+        self.compressors = {}
+
+    def compressor(self, level, wbits):
+        try:
+            return self.compressors[level, wbits]
+        except KeyError:
+            compressor = self.compressors[level, wbits] = zlib.compressobj(
+                level, zlib.DEFLATED, -wbits)
+            return compressor
+
+
+def deflate_message(data, level=zlib.Z_DEFAULT_COMPRESSION,
+                    wbits=MAX_WINDOW_BITS, pool=None):
+    '''Compresses a whole message with no context taken from, or left for,
+    any other message.'''
+    if pool is None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -wbits)
+    else:
+        compressor = pool.compressor(level, wbits)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+    if compressed.endswith(TAIL):
+        compressed = compressed[:-4]
+    return compressed
+
+
+class PerMessageDeflate:
+    '''The negotiated state of the permessage-deflate extension for one
+    connection. The server_* and client_* parameters are those agreed in
+    the handshake, and are mapped to our own (local) and the peer's
+    (remote) side depending on the role.'''
+    name = 'permessage-deflate'
+
+    def __init__(self, role,
+                 server_no_context_takeover=False,
+                 client_no_context_takeover=False,
+                 server_max_window_bits=MAX_WINDOW_BITS,
+                 client_max_window_bits=MAX_WINDOW_BITS,
+                 level=zlib.Z_DEFAULT_COMPRESSION,
+                 pool=None):
+        if role == 'CLIENT':
+            role = Roles.CLIENT
+        elif role == 'SERVER':
+            role = Roles.SERVER
+        self.role = role
+        if self.role is Roles.SERVER:
+            self.local_no_context_takeover = server_no_context_takeover
+            self.local_max_window_bits = server_max_window_bits
+            self.remote_no_context_takeover = client_no_context_takeover
+            self.remote_max_window_bits = client_max_window_bits
+        else:
+            self.local_no_context_takeover = client_no_context_takeover
+            self.local_max_window_bits = client_max_window_bits
+            self.remote_no_context_takeover = server_no_context_takeover
+            self.remote_max_window_bits = server_max_window_bits
+        if self.local_max_window_bits < MIN_WINDOW_BITS:
+            raise NnwsProtocolError('Unsupported window bits for '
+                                    'compression:',
+                                    self.local_max_window_bits)
+        self.level = level
+        # Only worth using when there's no context to keep between messages.
+        self.pool = pool if self.local_no_context_takeover else None
+
+        self.compressor = None
+        self.decompressor = None
+        # Whether the data message being sent / received is compressed.
+        self.compressing = False
+        self.decompressing = False
+        # How much of the message being received has been inflated.
+        self.inflated = 0
+
+    @staticmethod
+    def offer(server_no_context_takeover=False,
+              client_no_context_takeover=False,
+              server_max_window_bits=None,
+              client_max_window_bits=True):
+        '''Builds the parameters a client offers in its handshake, suitable
+        for Handshake.client_handshake's extensions.'''
+        params = {}
+        if server_no_context_takeover:
+            params['server_no_context_takeover'] = None
+        if client_no_context_takeover:
+            params['client_no_context_takeover'] = None
+        if server_max_window_bits is not None:
+            params['server_max_window_bits'] = str(server_max_window_bits)
+        if client_max_window_bits is True:
+            params['client_max_window_bits'] = None
+        elif client_max_window_bits:
+            params['client_max_window_bits'] = str(client_max_window_bits)
+        return params
+
+    @classmethod
+    def from_response(cls, params, **kwargs):
+        '''Builds the client's side from the parameters in the server's
+        response.'''
+        return cls(
+            Roles.CLIENT,
+            server_no_context_takeover='server_no_context_takeover' in params,
+            client_no_context_takeover='client_no_context_takeover' in params,
+            server_max_window_bits=window_bits(
+                params.get('server_max_window_bits'),
+                'server_max_window_bits'),
+            client_max_window_bits=window_bits(
+                params.get('client_max_window_bits'),
+                'client_max_window_bits'),
+            **kwargs)
+
+    @classmethod
+    def accept(cls, params,
+               server_no_context_takeover=False,
+               client_no_context_takeover=False,
+               server_max_window_bits=None,
+               client_max_window_bits=None,
+               **kwargs):
+        '''Builds the server's side from a client's offered parameters and
+        the server's own preferences. Returns the PerMessageDeflate along
+        with the parameters for the server's response, or (None, None) if
+        the offer can't be accepted.'''
+        response = {}
+        if server_no_context_takeover or 'server_no_context_takeover' in params:
+            server_no_context_takeover = True
+            response['server_no_context_takeover'] = None
+        if client_no_context_takeover or 'client_no_context_takeover' in params:
+            client_no_context_takeover = True
+            response['client_no_context_takeover'] = None
+
+        server_bits = MAX_WINDOW_BITS
+        if 'server_max_window_bits' in params:
+            server_bits = window_bits(params['server_max_window_bits'],
+                                      'server_max_window_bits')
+        if server_max_window_bits is not None:
+            server_bits = min(server_bits, server_max_window_bits)
+        if server_bits < MIN_WINDOW_BITS:
+            return None, None
+        if server_bits != MAX_WINDOW_BITS:
+            response['server_max_window_bits'] = str(server_bits)
+
+        client_bits = MAX_WINDOW_BITS
+        if 'client_max_window_bits' in params:
+            client_bits = window_bits(params['client_max_window_bits'],
+                                      'client_max_window_bits')
+            if client_max_window_bits is not None:
+                client_bits = min(client_bits, client_max_window_bits)
+            if client_bits != MAX_WINDOW_BITS:
+                response['client_max_window_bits'] = str(client_bits)
+
+        return cls(Roles.SERVER,
+                   server_no_context_takeover=server_no_context_takeover,
+                   client_no_context_takeover=client_no_context_takeover,
+                   server_max_window_bits=server_bits,
+                   client_max_window_bits=client_bits,
+                   **kwargs), response
+
+    def compress(self, data, fin, whole=False):
+        '''Compresses one frame's worth of an outgoing message. `whole` is
+        set when the frame is the entire message.'''
+        if whole and self.pool is not None:
+            return deflate_message(data, self.level,
+                                   self.local_max_window_bits, self.pool)
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, -self.local_max_window_bits)
+        compressed = (self.compressor.compress(data) +
+                      self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        if fin:
+            if compressed.endswith(TAIL):
+                compressed = compressed[:-4]
+            if self.local_no_context_takeover:
+                self.compressor = None
+        return compressed
+
+    def decompress(self, data, fin, max_size=None, max_piece=None):
+        '''Decompresses one frame's (or streamed chunk's) worth of an
+        incoming message in to a bytearray. Output is inflated in bounded
+        pieces, and if the message as a whole inflates past max_size, or
+        this frame alone past max_piece, NnwsMessageTooBigError is raised
+        before any more is inflated.'''
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(
+                -self.remote_max_window_bits)
+        inflated = bytearray()
+        try:
+            self.inflate_in_to(inflated, data, max_size, max_piece)
+            if fin:
+                self.inflate_in_to(inflated, TAIL, max_size, max_piece)
+        except zlib.error as e:
+            self.reset_decompression()
+            raise NnwsProtocolError('Bad compressed data:', e)
+        if fin:
+            self.inflated = 0
+            if self.remote_no_context_takeover:
+                self.decompressor = None
+        return inflated
+
+    def inflate_in_to(self, inflated, data, max_size, max_piece=None):
+        while True:
+            piece = self.decompressor.decompress(data, INFLATE_CHUNK)
+            self.inflated += len(piece)
+            if max_size is not None and self.inflated > max_size:
+                self.reset_decompression()
+                raise NnwsMessageTooBigError('Decompressed message too big')
+            if (max_piece is not None and
+                    len(inflated) + len(piece) > max_piece):
+                self.reset_decompression()
+                raise NnwsMessageTooBigError('Decompressed frame too big')
+            inflated.extend(piece)
+            data = self.decompressor.unconsumed_tail
+            if not data and len(piece) < INFLATE_CHUNK:
+                return
+
+    def reset_decompression(self):
+        '''Throws away the state of a message that failed to inflate.'''
+        self.decompressor = None
+        self.decompressing = False
+        self.inflated = 0
+
+    def outgoing(self, data, opcode, fin, compress=True):
+        '''Called for every outgoing data frame, compressing it if it
+        belongs to a compressed message. Returns the payload and whether
+        to set the first reserved bit.'''
+        rsv_1 = False
+        if opcode:
+            self.compressing = compress
+            rsv_1 = compress
+        if self.compressing:
+            data = self.compress(data, fin, whole=bool(opcode) and fin)
+        if fin:
+            self.compressing = False
+        return data, rsv_1
+
+    def incoming(self, data, first, rsv_1, fin, max_size=None,
+                 max_piece=None):
+        '''Called for every incoming data frame or chunk, decompressing it
+        if it belongs to a compressed message. `first` marks the start of a
+        frame that starts a message and `fin` the end of the message.
+        max_size limits the decompressed size of the whole message, and
+        max_piece that of this one frame or chunk.'''
+        if first:
+            self.decompressing = bool(rsv_1)
+        if self.decompressing:
+            data = self.decompress(data, fin, max_size, max_piece)
+        if fin:
+            self.decompressing = False
+        return data
@@ -1,4 +1,8 @@
-all = ['NnwsBaseError', 'NnwsProtocolError']
+all = ['NnwsBaseError',
+       'NnwsProtocolError',
+       'NnwsInvalidPayloadError',
+       'NnwsMessageTooBigError',
+       'NnwsConnectionClosed']
 
 
 class NnwsBaseError(Exception):
@@ -6,4 +10,25 @@ class NnwsBaseError(Exception):
 
 
 class NnwsProtocolError(NnwsBaseError):
-    pass
+    '''The connection should be failed, closing with status_code.'''
+    status_code = 1002
+
+
+class NnwsInvalidPayloadError(NnwsProtocolError):
+    '''Raised when a payload's data isn't valid for its type, such as a
+    text message that isn't UTF-8.'''
+    status_code = 1007
+
+
+class NnwsMessageTooBigError(NnwsProtocolError):
+    status_code = 1009
+
+
+class NnwsConnectionClosed(NnwsBaseError):
+    '''Raised when using a connection that has closed, with the close frame's
+    status code and reason. A connection that dropped without a close frame
+    has the code 1006.'''
+    def __init__(self, code=1006, reason=''):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
@@ -1,5 +1,5 @@
 from urllib.parse import urlparse, urlunparse
-from random import randint, getrandbits
+from random import randint
 from base64 import b64encode, b64decode
 from hashlib import sha1
 from collections import OrderedDict
@@ -9,6 +9,8 @@ import noio_ws as ws
 
 from .constants import *
 from .errors import NnwsProtocolError
+from .masking import mask_unmask
+from .deflate import PerMessageDeflate
 
 __all__ = ['Handshake']
 
@@ -24,6 +26,12 @@ def secondary_nonce_creator(nonce):
     return concatd_nonce
 
 
+def has_token(value, token):
+    '''Whether a comma separated header value, such as Connection's
+    "keep-alive, Upgrade", holds token, ignoring case.'''
+    return token in (part.strip().lower() for part in value.split(','))
+
+
 class Handshake:
     def __init__(self, role):
         if role == 'CLIENT':
@@ -38,11 +46,19 @@ class Handshake:
             self.hcon = h11.Connection(our_role=h11.SERVER)
 
         self.nonce = None
+        # The client's offered extensions, once a request is verified.
+        self.offered_extensions = OrderedDict()
+        # The agreed PerMessageDeflate, to be passed to the Connection.
+        self.deflate = None
 
     def client_handshake(self, uri, *,
                          subprotocols=None,
                          extensions=None,
+                         deflate=False,
                          **kwargs):
+        '''Builds the opening h11.Request. Passing deflate=True offers the
+        permessage-deflate extension, or pass a dict of keyword arguments
+        for PerMessageDeflate.offer.'''
 
         scheme, netloc, path, _, _, _ = urlparse(uri)
         try:
@@ -65,6 +81,10 @@ class Handshake:
         if subprotocols is not None:
             headers['sec-websocket-protocol'] = self._addon_header_str_ifier(
                 subprotocols)
+        if deflate:
+            extensions = OrderedDict(extensions or ())
+            extensions[PerMessageDeflate.name] = PerMessageDeflate.offer(
+                **(deflate if isinstance(deflate, dict) else {}))
         if extensions is not None:
             headers['sec-websocket-extensions'] = self._addon_header_str_ifier(
                 extensions)
@@ -85,7 +105,7 @@ class Handshake:
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Invalid response on upgrade header')
         try:
-            assert headers['connection'].lower() == 'upgrade'
+            assert has_token(headers['connection'], 'upgrade')
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Invalid response on connection header')
         try:
@@ -96,21 +116,25 @@ class Handshake:
             raise NnwsProtocolError('Invalid response on sec-websocket'
                                     '-accept header')
 
-        return self._parse_response_for_addons(response)
+        extensions, protocols = self._parse_response_for_addons(response)
+        if PerMessageDeflate.name in extensions:
+            self.deflate = PerMessageDeflate.from_response(
+                extensions[PerMessageDeflate.name])
+        return extensions, protocols
 
     def verify_request(self, request):
         headers = self.normalise_headers(dict(request.headers))
         try:
-            assert headers['upgrade'] == 'websocket'
+            assert headers['upgrade'].lower() == 'websocket'
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Invalid request on upgrade header')
         try:
-            assert headers['connection'] == 'upgrade'
+            assert has_token(headers['connection'], 'upgrade')
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Invalid request on connection header')
         try:
-            self.nonce = headers['sec-websocket-key']
-            assert len(b64decode(str(self.nonce, 'utf-8'))) == 16
+            self.nonce = headers['sec-websocket-key'].encode('utf-8')
+            assert len(b64decode(self.nonce)) == 16
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Bad nonce from client')
         try:
@@ -118,22 +142,35 @@ class Handshake:
         except (KeyError, AssertionError):
             raise NnwsProtocolError('Bad version from client')
 
-        return self._parse_response_for_addons(request)
+        extensions, protocols = self._parse_response_for_addons(request)
+        self.offered_extensions = extensions
+        return extensions, protocols
 
     def server_handshake(self,
                          subprotocols=None,
                          extensions=None,
+                         deflate=False,
                          **kwargs):
+        '''Builds the 101 h11.InformationalResponse. Passing deflate=True
+        accepts permessage-deflate if the client offered it, or pass a dict
+        of keyword arguments for PerMessageDeflate.accept.'''
+        if deflate and PerMessageDeflate.name in self.offered_extensions:
+            self.deflate, params = PerMessageDeflate.accept(
+                self.offered_extensions[PerMessageDeflate.name],
+                **(deflate if isinstance(deflate, dict) else {}))
+            if self.deflate is not None:
+                extensions = OrderedDict(extensions or ())
+                extensions[PerMessageDeflate.name] = params
         headers = {'upgrade': 'websocket',
                    'connection': 'upgrade',
                    'sec-websocket-accept': secondary_nonce_creator(self.nonce),
                    'sec-websocket-version': '13'}
         if subprotocols:
             headers['sec-websocket-protocol'] = self._addon_header_str_ifier(
-                self.subprotocols)
+                subprotocols)
         if extensions:
             headers['sec-websocket-extensions'] = self._addon_header_str_ifier(
-                self.extensions)
+                extensions)
         if kwargs:
             headers.update(kwargs)
         return h11.InformationalResponse(
@@ -143,11 +180,14 @@ class Handshake:
     def _parse_response_for_addons(self, response_obj):
         extension_headers = []
         subprotocol_headers = []
-        for header in response_obj.headers:
-            if header[0] == 'sec-websocket-extensions':
-                extension_headers.append(header[1].decode('utf-8'))
-            elif header[0] == 'sec-websocket-protocols':
-                subprotocol_headers.append(header[1].decode('utf-8'))
+        for name, value in response_obj.headers:
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            name = name.lower()
+            if name == 'sec-websocket-extensions':
+                extension_headers.append(value.decode('utf-8'))
+            elif name == 'sec-websocket-protocol':
+                subprotocol_headers.append(value.decode('utf-8'))
 
         extensions = self._parse_addon_header(','.join(extension_headers))
         protocols = self._parse_addon_header(','.join(subprotocol_headers))
@@ -155,32 +195,35 @@ class Handshake:
         return extensions, protocols
 
     def _parse_addon_header(self, header):
-        all_vals = header.replace(', ', ',').split(',')
+        '''Parses an extension or subprotocol header in to an OrderedDict of
+        {name: {param: value}}, with None as the value of bare params.'''
         results = OrderedDict()
-        for item in all_vals:
-            sub_val = item.split(';')
+        for item in header.split(','):
+            name, *params = item.split(';')
+            name = name.strip()
+            if not name:
+                continue
             val_details = {}
-            name, *params = sub_val
-            if params:
-                for param in params:
-                    arg, value = param.strip().split('=')
-                    try:
-                        val_details[arg] = value
-                    except IndexError:
-                        val_details[arg] = None
+            for param in params:
+                arg, eq, value = param.partition('=')
+                value = value.strip().strip('"')
+                val_details[arg.strip()] = value if eq else None
             results[name] = val_details
         return results
 
     def _addon_header_str_ifier(self, header_items):
-        assert isinstance(header_items, OrderedDict)
+        '''The reverse of _parse_addon_header. Plain strings and lists of
+        names are also accepted.'''
+        if isinstance(header_items, str):
+            return header_items
+        if not isinstance(header_items, dict):
+            header_items = OrderedDict((item, {}) for item in header_items)
         header_fields = []
-        for item in header_items:
-            header_holding = []
-            header_holding.append(item.pop('name'))
-            if item:
-                for k, v in item.items():
-                    header_holding.append('='.join([k, v]))
-            header_fields.append(';'.join(header_holding))
+        for name, params in header_items.items():
+            header_holding = [name]
+            for k, v in (params or {}).items():
+                header_holding.append(k if v is None else '='.join([k, v]))
+            header_fields.append('; '.join(header_holding))
         return ', '.join(header_fields)
 
     def normalise_headers(self, headers):
@@ -192,9 +235,3 @@ class Handshake:
             except AttributeError:
                 normalised_headers[k.lower()] = v.decode()
         return normalised_headers
-
-
-def mask_unmask(data, mask):
-    for i, x in enumerate(data):
-        data[i] = x ^ mask[i % 4]
-    return data
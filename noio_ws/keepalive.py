@@ -0,0 +1,70 @@
+'''Keepalive pings.
+
+A Keepalive is passed to the Connection, which then decides when pings are
+due and when the other side has stopped answering them. Being sans-io,
+nothing here sets timers: the Connection's tick method is called with the
+current time, and next_deadline says when it next needs calling.'''
+from struct import Struct
+
+from .constants import Information
+
+
+__all__ = ['Keepalive']
+
+# Each ping carries a counter, so its pong can be told apart from late or
+# unsolicited pongs.
+PING_ID = Struct('!I')
+
+
+class Keepalive:
+    '''Sends a ping every `interval` seconds, and gives up on the connection
+    if the ping's pong hasn't arrived within `timeout` seconds (which
+    defaults to the interval). Times come from the Connection's clock.'''
+    def __init__(self, interval, timeout=None):
+        if interval <= 0:
+            raise ValueError('interval must be > 0')
+        self.interval = interval
+        self.timeout = interval if timeout is None else timeout
+
+        self.next_ping = None
+        self.ping_id = 0
+        # The payload of the ping awaiting its pong, and when it was sent.
+        self.awaiting = None
+        self.sent_at = None
+        # The round trip time of the latest answered ping, in seconds.
+        self.rtt = None
+
+    def start(self, now):
+        '''Schedules the first ping, an interval from now.'''
+        self.next_ping = now + self.interval
+
+    @property
+    def deadline(self):
+        '''When tick next has something to do.'''
+        if self.awaiting is not None:
+            return self.sent_at + self.timeout
+        return self.next_ping
+
+    def tick(self, now):
+        '''Returns Information.SEND_PING when a ping is due, having made its
+        payload, Information.CONNECTION_CLOSED when a pong is overdue, and
+        otherwise None.'''
+        if self.awaiting is not None:
+            if now >= self.sent_at + self.timeout:
+                return Information.CONNECTION_CLOSED
+        elif now >= self.next_ping:
+            self.ping_id = (self.ping_id + 1) & 0xffffffff
+            self.awaiting = PING_ID.pack(self.ping_id)
+            self.sent_at = now
+            return Information.SEND_PING
+        return None
+
+    def pong(self, payload, now):
+        '''Called with every pong received. The pong answering the
+        outstanding ping records the round trip time, and the next ping is
+        scheduled an interval after the last one was sent.'''
+        if self.awaiting is None or payload != self.awaiting:
+            return
+        self.rtt = now - self.sent_at
+        self.next_ping = self.sent_at + self.interval
+        self.awaiting = None
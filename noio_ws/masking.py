@@ -0,0 +1,106 @@
+'''Payload masking. Every client frame's payload, and so every payload a
+server receives, is XORed against a 4 byte mask. Rather than walking the
+payload a byte at a time, the backends here work on the whole buffer at
+once. NumPy is used when it is installed, otherwise the payload is XORed
+as one big int against the repeated mask.'''
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+__all__ = ['mask_unmask', 'mask_regions', 'BACKEND', 'BACKENDS']
+
+# Below this many bytes the fixed overhead of building numpy arrays costs
+# more than the int backend does.
+NUMPY_THRESHOLD = 1024
+
+
+def _rotate(mask, offset):
+    '''Lines the mask up with a payload that starts `offset` bytes in to
+    the masked data.'''
+    offset %= 4
+    if offset:
+        return mask[offset:] + mask[:offset]
+    return mask
+
+
+def mask_loop(data, mask, offset=0):
+    '''The byte at a time reference implementation.'''
+    mask = _rotate(mask, offset)
+    for i, x in enumerate(data):
+        data[i] = x ^ mask[i % 4]
+    return data
+
+
+def mask_int(data, mask, offset=0):
+    '''XORs the payload, as a single int, against the mask repeated to the
+    length of the payload.'''
+    size = len(data)
+    if not size:
+        return data
+    mask = bytes(_rotate(mask, offset))
+    repeated = (mask * ((size >> 2) + 1))[:size]
+    unmasked = (int.from_bytes(data, 'little') ^
+                int.from_bytes(repeated, 'little')).to_bytes(size, 'little')
+    if isinstance(data, bytes):
+        return bytearray(unmasked)
+    data[:] = unmasked
+    return data
+
+
+def mask_numpy(data, mask, offset=0):
+    '''XORs the payload four bytes at a time as uint32s, finishing off any
+    trailing bytes individually.'''
+    if isinstance(data, bytes):
+        data = bytearray(data)
+    size = len(data)
+    if not size:
+        return data
+    mask = bytes(_rotate(mask, offset))
+    arr = numpy.frombuffer(data, dtype=numpy.uint8)
+    words = size >> 2
+    if words:
+        arr[:words << 2].view(numpy.uint32).__ixor__(
+            numpy.frombuffer(mask, dtype=numpy.uint32)[0])
+    tail = size & 3
+    if tail:
+        arr[words << 2:] ^= numpy.frombuffer(mask[:tail], dtype=numpy.uint8)
+    return data
+
+
+BACKENDS = {'loop': mask_loop, 'int': mask_int}
+if numpy is not None:
+    BACKENDS['numpy'] = mask_numpy
+
+    def mask_unmask(data, mask, offset=0):
+        '''Masks or unmasks data in place, returning it. Immutable bytes are
+        copied in to a new bytearray first. `offset` is the position of the
+        data's first byte within the masked payload, for when a payload is
+        processed in pieces.'''
+        if len(data) < NUMPY_THRESHOLD:
+            return mask_int(data, mask, offset)
+        return mask_numpy(data, mask, offset)
+
+    BACKEND = 'numpy'
+else:
+    mask_unmask = mask_int
+    BACKEND = 'int'
+
+
+def mask_regions(data, regions):
+    '''Masks many payloads within one buffer in a single pass. regions are
+    (offset, length, mask) tuples. Their masks are laid out in a key the
+    size of the buffer, zero elsewhere, which is XORed over the whole of it
+    at once rather than payload by payload.'''
+    size = len(data)
+    key = bytearray(size)
+    for offset, length, mask in regions:
+        key[offset:offset + length] = (mask * ((length >> 2) + 1))[:length]
+    if numpy is not None and size >= NUMPY_THRESHOLD:
+        numpy.frombuffer(data, dtype=numpy.uint8).__ixor__(
+            numpy.frombuffer(key, dtype=numpy.uint8))
+    else:
+        data[:] = (int.from_bytes(data, 'little') ^
+                   int.from_bytes(key, 'little')).to_bytes(size, 'little')
+    return data
@@ -1,26 +1,48 @@
+import mmap
+import os
 from random import getrandbits
-from datetime import datetime
+from struct import Struct
+from tempfile import TemporaryFile
 
 from .constants import *
-from .handshake_utils import mask_unmask
+from .errors import NnwsProtocolError
+from .masking import mask_unmask
+from .deflate import deflate_message
 
 
-__all__ = ['FrameParser',
+__all__ = ['EXTENDED_LEN',
+           'OpcodeTable',
+           'FrameParser',
            'BaseFrame',
            'Message',
            'ReceivedFrame',
            'ControlMessage',
+           'PayloadChunk',
            'TypeFrameBuffer',
-           'SendFrame']
+           'SendFrame',
+           'PreparedFrame',
+           'FileFrame']
 
 
 class BaseFrame:
-    def __init__(self, payload, f_type, reserved):
-        '''The base type for all received frames.'''
+    __slots__ = ('payload', 'f_type', 'rsv', 'time', 'decoded_text')
+
+    def __init__(self, payload, f_type, rsv=0, time=None):
+        '''The base type for all received frames. rsv holds the three
+        reserved bits as an int, laid out as in the header, and time is
+        the time.monotonic_ns() the frame was received at, if the
+        Connection keeps timestamps.'''
         self.payload = payload
         self.f_type = f_type
-        self.reserved = reserved
-        self.time = datetime.now()
+        self.rsv = rsv
+        self.time = time
+        # Only set for text frames when the Connection decodes text.
+        self.decoded_text = None
+
+    @property
+    def reserved(self):
+        '''The reserved bits as a (rsv_1, rsv_2, rsv_3) tuple.'''
+        return RESERVED[self.rsv]
 
     @property
     def data(self):
@@ -33,22 +55,47 @@ class BaseFrame:
     def __repr__(self):
         repr_str = ('{}:(payload="{}", f_type="{}",reserved={}, ' +
                     'time={})')
+        if hasattr(self.payload, 'read'):
+            payload = repr(self.payload)
+        else:
+            payload = (str(self.payload[:9]) +
+                       ('[...]' if len(self.payload) > 9 else ''))
         return repr_str.format(
             hex(id(self)),
-            str(self.payload[:9]) + ('[...]' if len(self.payload) > 9 else ''),
+            payload,
             self.f_type,
             self.reserved,
             self.time)
 
 
 class Message(BaseFrame):
-    '''The type of frame used for full message interactions.'''
-    pass
+    '''The type of frame used for full message interactions. A message that
+    grew past the Connection's spill_threshold has a temporary file,
+    positioned at the start, as its payload rather than a bytearray.'''
+    __slots__ = ()
+
+    @property
+    def spilled(self):
+        '''Whether the payload was spilled to a temporary file.'''
+        return hasattr(self.payload, 'read')
+
+    def view(self):
+        '''Returns the payload as a memoryview, mapping a spilled payload's
+        file in to memory rather than reading it.'''
+        if not self.spilled:
+            return memoryview(self.payload)
+        size = os.fstat(self.payload.fileno()).st_size
+        if not size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(self.payload.fileno(), size,
+                                    access=mmap.ACCESS_READ))
 
 
 class ReceivedFrame(BaseFrame):
     '''The type of frame used for interactions where partial frames are
     events.'''
+    __slots__ = ('fin',)
+
     def __init__(self, fin=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fin = fin
@@ -56,13 +103,26 @@ class ReceivedFrame(BaseFrame):
     def combine(self, frame_obj):
         self.fin = frame_obj.fin
         self.payload.extend(frame_obj.payload)
-        self.reserved = frame_obj.reserved
+        self.rsv = frame_obj.rsv
         self.time = frame_obj.time
 
 
 class ControlMessage(BaseFrame):
     '''The frame type used for control frames.'''
-    pass
+    __slots__ = ()
+
+
+class PayloadChunk(BaseFrame):
+    '''The frame type used when streaming, holding however much of a non-
+    control frame's payload had arrived. frame_fin is set on the last chunk
+    of each frame, and message_fin on the last chunk of each message. The
+    f_type is always the message's type, even for continuation frames.'''
+    __slots__ = ('frame_fin', 'message_fin')
+
+    def __init__(self, frame_fin=False, message_fin=False, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_fin = frame_fin
+        self.message_fin = message_fin
 
 
 class TypeFrameBuffer:
@@ -109,88 +169,182 @@ class TypeFrameBuffer:
         return self.f.fin
 
 
+class OpcodeTable:
+    '''Everything derived from a connection's opcode map, worked out once
+    when the connection is created.
+
+    byte_0 and byte_1 are 256 entry lookup tables for the first two bytes
+    of a frame header. byte_0 maps to (fin, rsv bits, opcode name),
+    with None as the name for opcodes not in the map. byte_1 maps to
+    (masked, 7 bit length, offset of the end of the length field).
+
+    numbers maps opcode names back to opcodes for sending, and headers
+    caches encoded short frame headers. type_frames and control_frames
+    are the names of the non-control (other than continue) and control
+    opcodes.
+
+    Tables never change once made, so connections with the same opcodes
+    share one, from OpcodeTable.shared.'''
+    # Every table made by shared, keyed by the frozenset of opcode items.
+    tables = {}
+
+    @classmethod
+    def shared(cls, opcodes):
+        '''Returns the table for opcodes, making it only the first time.'''
+        key = frozenset(opcodes.items())
+        try:
+            return cls.tables[key]
+        except KeyError:
+            table = cls.tables[key] = cls(opcodes)
+            return table
+
+    def __init__(self, opcodes):
+        self.opcodes = dict(opcodes)
+        self.byte_0 = tuple(
+            (bool(b & 0b10000000),
+             (b >> 4) & 0b111,
+             opcodes.get(b & 0b1111))
+            for b in range(256))
+        self.byte_1 = tuple(
+            (bool(b & 0b10000000),
+             b & 0b1111111,
+             {126: 4, 127: 10}.get(b & 0b1111111, 0))
+            for b in range(256))
+
+        self.numbers = {ophrase: opcode for opcode, ophrase in opcodes.items()}
+        self.type_frames = frozenset(
+            ophrase for opcode, ophrase in opcodes.items() if 0 < opcode < 8)
+        self.control_frames = frozenset(
+            ophrase for opcode, ophrase in opcodes.items() if opcode >= 8)
+        self.headers = {}
+
+    def header(self, byte_0, length, masked):
+        '''Packs a frame header, leaving off the mask key. Headers of frames
+        with payloads short enough to fit in the second byte are cached.'''
+        byte_1 = masked << 7
+        if length <= 125:
+            key = byte_0 << 8 | byte_1 | length
+            try:
+                return self.headers[key]
+            except KeyError:
+                header = self.headers[key] = bytes((byte_0, byte_1 | length))
+                return header
+        elif length <= 65535:
+            return HEADER_16.pack(byte_0, byte_1 | 126, length)
+        elif length <= 9223372036854775807:
+            return HEADER_64.pack(byte_0, byte_1 | 127, length)
+        raise NnwsProtocolError('Data > 8.388 million TB, you lunatic.')
+
+
+# Unpackers for the 16 and 64 bit extended payload lengths, keyed by the
+# offset of the end of the length field.
+EXTENDED_LEN = {4: Struct('!H').unpack_from,
+                10: Struct('!Q').unpack_from}
+HEADER_16 = Struct('!BBH')
+HEADER_64 = Struct('!BBQ')
+
+VALID_RSV = (None, 0, 1)
+
+# The reserved bits packed in to an int, unpacked in to a tuple.
+RESERVED = tuple(((rsv >> 2) & 1, (rsv >> 1) & 1, rsv & 1)
+                 for rsv in range(8))
+
+
 class FrameParser:
     '''The parser class that deals with parsing an incoming frame's
     headers.'''
-    def __init__(self, bufferdata, opcodes):
-        self.buffer = bufferdata
-        self.opcodes = opcodes
+    __slots__ = ('optable', 'fin', 'rsv', 'opcode', 'masked', 'mask',
+                 'expected_len', 'received', 'l_bound', 'pl_strt', 'raw_len',
+                 'payload', 'message_size')
+
+    def __init__(self, optable):
+        self.optable = optable
+        self.reset()
+
+    def reset(self):
+        '''Clears the parser for the next frame, so that one parser can be
+        reused for every frame on a connection.'''
         self.fin = False
-        self.resrvd = [0, 0, 0]
+        self.rsv = 0
         self.opcode = None
         self.masked = False
         self.mask = None
 
         self.expected_len = 0
-        self.remaining_len = 0
+        # How much of the payload has been streamed out so far.
+        self.received = 0
 
         self.l_bound = 0
         self.pl_strt = 2
+        self.raw_len = 0
 
-        self.payload = bytearray()
+        # Set once the whole payload has arrived.
+        self.payload = None
 
-        self.frame_size = 0
+        # When this is the first frame of a fragmented message, the combined
+        # payload size of its frames so far.
+        self.message_size = 0
 
-    def proc(self, ROLE):
+    def proc(self, ROLE, buffer, start):
         '''When sufficient bytes have been received, the parsing of a frame
-        can begin. This proc method is...procced, and so begins the parsing.'''
-        b1, b2 = self.buffer[:2]
-        # check fin
-        if b1 & 0b10000000:
-            self.fin = True
-        # check rsvd
-        if b1 & 0b01000000:
-            self.resrvd[0] = 1
-        if b1 & 0b00100000:
-            self.resrvd[1] = 1
-        if b1 & 0b00010000:
-            self.resrvd[2] = 1
-
-        # check opcode
-        try:
-            self.opcode = next(
-                (ophrase for opcode, ophrase in self.opcodes.items()
-                 if b1 & 0b1111 == opcode))
-        except StopIteration:
+        can begin. This proc method is...procced, and so begins the parsing.
+        The frame's header begins at offset `start` in `buffer`.'''
+        self.fin, self.rsv, self.opcode = self.optable.byte_0[
+            buffer[start]]
+        if self.opcode is None:
             raise NnwsProtocolError('Invalid opcode received.')
 
-        # check masked
-        if b2 & 0b10000000:
-            if ROLE is Roles.CLIENT:
-                raise NnwsProtocolError('Masked frame from server.')
-            else:
-                self.masked = True
-
-        # get length
-        self.expected_len = int(bin(b2)[2:].zfill(8)[1:], 2)
-        if self.expected_len <= 125:
-            pass
-        elif self.expected_len == 126:
-            self.l_bound = 4
-        elif self.expected_len == 127:
-            self.l_bound = 10
-        else:
-            raise NnwsProtocolError('Bad len indicator:',
-                                    self.expected_len)
-
-    def incorporate(self, frame):
+        self.masked, self.expected_len, self.l_bound = self.optable.byte_1[
+            buffer[start + 1]]
+        if self.masked and ROLE is Roles.CLIENT:
+            raise NnwsProtocolError('Masked frame from server.')
+        if self.opcode in self.optable.control_frames:
+            if not self.fin:
+                raise NnwsProtocolError('Fragmented control frame.')
+            if self.l_bound:
+                raise NnwsProtocolError('Control frame payload over 125 '
+                                        'bytes.')
+
+    def hold(self):
+        '''Marks this frame as the first of a fragmented message.'''
+        self.message_size = len(self.payload)
+
+    def incorporate(self, frame, collect=True, spill_threshold=None):
         '''Incorporates one frame in to another, used to combine multiple
-        frames in to full Message objects.'''
-        self.buffer.extend(frame.buffer)
-        for index, rsrv in enumerate(self.resrvd):
-            if not rsrv and frame.resrvd[index]:
-                self.resrvd[index] = frame.resrvd[index]
-        self.frame_size += frame.frame_size
-        self.payload.extend(frame.payload)
+        frames in to full Message objects. Unless collect is set, the
+        payload is simply the latest frame's rather than a copy of it.
+        Once the combined payload grows past spill_threshold it is moved
+        in to a temporary file, and later frames are written there.'''
+        self.rsv |= frame.rsv
         self.fin = frame.fin
+        self.message_size += len(frame.payload)
+        if not collect:
+            self.payload = frame.payload
+        elif self.spilled:
+            self.payload.write(frame.payload)
+        elif (spill_threshold is not None and
+                self.message_size > spill_threshold):
+            spool = TemporaryFile()
+            spool.write(self.payload)
+            spool.write(frame.payload)
+            self.payload = spool
+        else:
+            self.payload += frame.payload
+
+    @property
+    def spilled(self):
+        return hasattr(self.payload, 'write')
 
 
 class SendFrame:
     '''The class used to construct frames for sending over network.'''
     def __init__(self, data, f_type, fin=True, status_code=None,
-                 rsv_1=None, rsv_2=None, rsv_3=None):
+                 rsv_1=None, rsv_2=None, rsv_3=None, compress=True):
         self.data = data
         self.f_type = f_type
+        # Only used when the connection has negotiated compression, and
+        # then only on a message's first frame.
+        self.compress = compress
 
         if fin is False:
             if self.f_type not in CONTROL_FRAMES:
@@ -205,100 +359,229 @@ class SendFrame:
 
         self.status_code = status_code
 
-        if rsv_1 is not None:
-            if (rsv_1 == 0 or rsv_1 == 1):
-                self.rsv_1 = rsv_1
-            else:
-                raise ValueError('Invalid value for reserve:', rsv_1)
-        else:
-            self.rsv_1 = rsv_1
-        if rsv_2 is not None:
-            if (rsv_2 == 0 or rsv_2 == 1):
-                self.rsv_2 = rsv_2
-            else:
-                raise ValueError('Invalid value for reserve:', rsv_2)
-        else:
-            self.rsv_2 = rsv_2
-        if rsv_3 is not None:
-            if (rsv_3 == 0 or rsv_3 == 1):
-                self.rsv_3 = rsv_3
-            else:
-                raise ValueError('Invalid value for reserve:', rsv_3)
-        else:
-            self.rsv_3 = rsv_3
-
-    def __call__(self, role, opcodes):
+        for rsv in (rsv_1, rsv_2, rsv_3):
+            if rsv not in VALID_RSV:
+                raise ValueError('Invalid value for reserve:', rsv)
+        self.rsv_1 = rsv_1
+        self.rsv_2 = rsv_2
+        self.rsv_3 = rsv_3
+        # fin and the reserved bits, laid out as in the first header byte.
+        self.bits = ((self.fin << 7) | (bool(rsv_1) << 6) |
+                     (bool(rsv_2) << 5) | (bool(rsv_3) << 4))
+
+    def __call__(self, role, optable, deflate=None):
         '''When the instance is called, a bunch'a operations take place that
         turn the frame in to a network suitable bytes object.'''
-        self.data = bytesify(self.data)
+        data, header, mask, close = self.prepare(role, optable, deflate)
+        if mask is None:
+            return header + data, close
+        return self.masked(header, data, mask), close
+
+    def buffers(self, role, optable, deflate=None):
+        '''Encodes the frame as a (header, payload) tuple of buffers. An
+        unmasked payload is a view of the frame's data, a masked one is
+        masked straight in to the same buffer as its header.'''
+        data, header, mask, close = self.prepare(role, optable, deflate)
+        if mask is None:
+            return (header, memoryview(data)), close
+        framed = memoryview(self.masked(header, data, mask))
+        return (framed[:len(header)], framed[len(header):]), close
+
+    def prepare(self, role, optable, deflate=None):
+        '''Works out the frame's header, returning the payload, the header,
+        the mask (None for unmasked frames) and whether this is a close.'''
+        data = bytesify(self.data)
 
-        bytes_to_go = bytearray()
         close = False
         if self.f_type == 'close':
             close = True
-            if self.data:
-                assert (1000 <= self.status_code <= 1015 or
-                        4000 <= self.status_code <= 4999)
-                self.data = self.status_code.to_bytes(2, 'big') + self.data
-
-        byte_0 = 0
-        if self.fin:
-            byte_0 = byte_0 | 1 << 7
-        if self.rsv_1:
-            byte_0 = byte_0 | 1 << 6
-        if self.rsv_2:
-            byte_0 = byte_0 | 1 << 5
-        if self.rsv_3:
-            byte_0 = byte_0 | 1 << 4
-
-        opcode = next((k for k, v in opcodes.items() if v == self.f_type))
-        byte_0 = byte_0 | opcode
-        bytes_to_go.append(byte_0)
-
-        byte_1 = 0
-        mask = None
+            if self.status_code is not None:
+                if not valid_close_code(self.status_code):
+                    raise ValueError('Invalid close status code:',
+                                     self.status_code)
+                data = self.status_code.to_bytes(2, 'big') + data
+
+        try:
+            opcode = optable.numbers[self.f_type]
+        except KeyError:
+            raise NnwsProtocolError('Unknown frame type:', self.f_type)
+
+        bits = self.bits
+        if deflate is not None and not opcode & 0b1000:
+            data, rsv_1 = deflate.outgoing(data, opcode, self.fin,
+                                           self.compress)
+            if rsv_1:
+                bits = bits | 1 << 6
+
+        data_len = len(data)
+        if opcode & 0b1000:
+            if data_len > 125:
+                raise NnwsProtocolError('Payload too big for'
+                                        'control frame.'
+                                        '{}/125:'.format(data_len))
+            if not self.fin:
+                raise NnwsProtocolError('Trying to fragment'
+                                        'control frame:', self.f_type)
 
         if role is Roles.CLIENT:
-            byte_1 = byte_1 | 1 << 7
             mask = getrandbits(32).to_bytes(4, 'big')
-            self.data = mask_unmask(self.data, mask)
-
-        data_len = len(self.data)
-        if data_len <= 125:
-            len_flag = data_len
-        elif data_len <= 65535:
-            len_flag = 126
-        elif data_len <= 9223372036854775807:
-            len_flag = 127
+            header = optable.header(bits | opcode, data_len, True) + mask
         else:
-            raise NnwsProtocolError('Data > 8.388 million TB, you lunatic.')
-        byte_1 = byte_1 | len_flag
-        bytes_to_go.append(byte_1)
-
-        if len_flag in [126, 127] and self.f_type in CONTROL_FRAMES:
-            raise NnwsProtocolError('Payload too big for'
-                                    'control frame.'
-                                    '{}/125:'.format(data_len))
-
-        if len_flag == 126:
-            bytes_to_go.extend(data_len.to_bytes(2, 'big'))
-        elif len_flag == 127:
-            bytes_to_go.extend(data_len.to_bytes(8, 'big'))
+            mask = None
+            header = optable.header(bits | opcode, data_len, False)
+
+        return data, header, mask, close
+
+    @staticmethod
+    def masked(header, data, mask):
+        '''Copies the header and payload in to one new buffer, masking the
+        payload in place there.'''
+        framed = bytearray(len(header) + len(data))
+        framed[:len(header)] = header
+        framed[len(header):] = data
+        mask_unmask(memoryview(framed)[len(header):], mask)
+        return framed
+
+
+class PreparedFrame:
+    '''A SendFrame that is encoded once and can then be sent to any number
+    of server role connections without being encoded again, for
+    broadcasting. Each variant of the encoded frame (uncompressed, or
+    compressed for connections without context takeover) is worked out the
+    first time a connection needs it and cached.'''
+    def __init__(self, frame):
+        assert isinstance(frame, SendFrame)
+        if not frame.fin:
+            raise NnwsProtocolError('Only whole messages can be prepared.')
+        self.frame = frame
+        self.data = bytesify(frame.data)
+        self.encoded = {}
+
+    def __call__(self, role, optable, deflate=None):
+        if role is not Roles.SERVER:
+            raise NnwsProtocolError('Prepared frames are unmasked, so can '
+                                    'only be sent by servers.')
+        opcode = optable.numbers.get(self.frame.f_type)
+        if (deflate is None or opcode is None or opcode & 0b1000 or
+                not self.frame.compress):
+            key = opcode
+        elif deflate.local_no_context_takeover:
+            key = opcode, deflate.level, deflate.local_max_window_bits
+        else:
+            # The compressed bytes depend on this connection's history.
+            return self.frame(role, optable, deflate)
+        try:
+            return self.encoded[key]
+        except KeyError:
+            pass
 
-        if mask is not None:
-            bytes_to_go.extend(mask)
+        if not isinstance(key, tuple):
+            encoded = self.frame(role, optable)
+        else:
+            data = deflate_message(self.data, deflate.level,
+                                   deflate.local_max_window_bits, deflate.pool)
+            header = optable.header(self.frame.bits | 1 << 6 | opcode,
+                                    len(data), False)
+            encoded = header + data, False
+        self.encoded[key] = encoded
+        return encoded
+
+
+class FileFrame:
+    '''A whole message whose payload is a range of a file, for sending
+    large files without reading them in to memory. A server's frame is
+    just a header followed by the file's bytes as they are, so the range
+    can be handed to os.sendfile. Otherwise the range is mapped in to
+    memory with mmap. The message is never compressed.
+
+    file is a path, a file descriptor or a binary file object. A file
+    opened from a path is closed by close, or at the end of a with
+    block.'''
+    def __init__(self, file, offset=0, length=None, f_type='binary'):
+        self.owns_file = False
+        if isinstance(file, int):
+            file = open(file, 'rb', closefd=False)
+        elif isinstance(file, (str, bytes, os.PathLike)):
+            file = open(file, 'rb')
+            self.owns_file = True
+        self.file = file
+        size = os.fstat(file.fileno()).st_size
+        if length is None:
+            length = size - offset
+        if offset < 0 or length < 0 or offset + length > size:
+            self.close()
+            raise ValueError('File range out of bounds:', offset, length)
+        self.offset = offset
+        self.length = length
+        self.f_type = f_type
 
-        bytes_to_go.extend(self.data)
-        return bytes(bytes_to_go), close
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+    def header(self, optable, masked):
+        opcode = optable.numbers.get(self.f_type)
+        if opcode is None or not 0 < opcode < 8:
+            raise NnwsProtocolError('File frames must be data frames:',
+                                    self.f_type)
+        return optable.header(0b10000000 | opcode, self.length, masked)
+
+    def view(self):
+        '''Maps the range in to memory, returning a read only memoryview of
+        it. The mapping is undone once the view is garbage collected.'''
+        if not self.length:
+            return memoryview(b'')
+        start = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(self.file.fileno(),
+                           self.offset + self.length - start,
+                           access=mmap.ACCESS_READ, offset=start)
+        return memoryview(mapped)[self.offset - start:]
+
+    def file_range(self, role, optable, deflate=None):
+        '''Encodes the frame as its header and the (file, offset, length)
+        of its payload, for os.sendfile or loop.sendfile. Servers only, as a
+        client's payload must be masked.'''
+        if role is not Roles.SERVER:
+            raise NnwsProtocolError('File ranges are unmasked, so can only '
+                                    'be sent by servers.')
+        return ((self.header(optable, False), self.file, self.offset,
+                 self.length), False)
+
+    def buffers(self, role, optable, deflate=None):
+        '''Encodes the frame as a (header, payload) tuple of buffers. An
+        unmasked payload is a view of the mapped file, a masked one is
+        masked in to a copy.'''
+        if role is Roles.SERVER:
+            return (self.header(optable, False), self.view()), False
+        framed, close = self(role, optable, deflate)
+        header_len = len(framed) - self.length
+        framed = memoryview(framed)
+        return (framed[:header_len], framed[header_len:]), close
+
+    def __call__(self, role, optable, deflate=None):
+        if role is Roles.SERVER:
+            return self.header(optable, False) + self.view(), False
+        mask = getrandbits(32).to_bytes(4, 'big')
+        header = self.header(optable, True) + mask
+        return SendFrame.masked(header, self.view(), mask), False
 
 
 def bytesify(data):
-    '''Turns things in to bytes.'''
+    '''Turns things in to bytes. Anything already bytes-like is passed
+    through as is, without being copied. Memoryviews are cast to bytes, so
+    their length is their size in bytes rather than in items.'''
     if isinstance(data, str):
-        data = bytearray(data, 'utf-8')
-    elif isinstance(data, bytes):
-        data = bytearray(data)
-    elif isinstance(data, bytearray):
+        data = data.encode('utf-8')
+    elif isinstance(data, memoryview):
+        if data.format != 'B' or data.ndim != 1:
+            data = data.cast('B')
+    elif isinstance(data, (bytes, bytearray)):
         pass
     else:
         raise NnwsProtocolError('Trying to send non-binary or non-utf8 data.')
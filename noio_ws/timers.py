@@ -0,0 +1,126 @@
+'''A hierarchical timer wheel, for keeping track of the deadlines of a great
+many connections at once.
+
+Each connection's next_deadline is scheduled on the wheel, and advance is
+called as time passes, returning every connection whose deadline is up.
+Those are then ticked and rescheduled::
+
+    wheel = TimerWheel(now)
+    wheel.schedule(conn, conn.next_deadline())
+    ...
+    for conn in wheel.advance(now):
+        result = conn.tick(now)
+        ...
+        wheel.schedule(conn, conn.next_deadline())
+
+Time is cut in to ticks of `resolution` seconds. The first level of the
+wheel has a slot for each of the next `slots` ticks, and each level above
+has slots spanning a whole turn of the level below. Scheduling and
+cancelling are O(1), and each deadline is moved down a level at most once
+per level before it expires, so advancing is O(1) amortised per deadline.
+Deadlines are never reported early, but may be up to one tick late.'''
+from math import ceil
+
+
+__all__ = ['TimerWheel']
+
+
+class TimerWheel:
+    '''Deadlines for any hashable keys, such as Connections. A key has at
+    most one deadline, so scheduling it again moves it.'''
+    def __init__(self, now, resolution=0.1, slots=256, levels=4):
+        if resolution <= 0:
+            raise ValueError('resolution must be > 0')
+        if slots < 2 or levels < 1:
+            raise ValueError('Need at least 2 slots and 1 level')
+        self.origin = now
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        # The number of ticks spanned by one slot of each level.
+        self.spans = [slots ** level for level in range(levels)]
+        self.horizon = slots ** levels - 1
+        # Each slot maps keys to the tick they're due at.
+        self.wheel = [[{} for _ in range(slots)] for _ in range(levels)]
+        # Where each key currently is, as a (level, slot) pair.
+        self.timers = {}
+        # The last tick that has been expired.
+        self.current = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline):
+        '''Sets key's deadline, replacing any it already had. A deadline of
+        None just cancels it.'''
+        self.cancel(key)
+        if deadline is None:
+            return
+        tick = ceil((deadline - self.origin) / self.resolution)
+        self.insert(key, max(tick, self.current + 1))
+
+    def cancel(self, key):
+        '''Removes key's deadline, if it has one.'''
+        where = self.timers.pop(key, None)
+        if where is not None:
+            level, slot = where
+            del self.wheel[level][slot][key]
+
+    def insert(self, key, tick):
+        delta = tick - self.current
+        place = tick
+        for level in range(self.levels):
+            if delta < self.spans[level] * self.slots:
+                break
+        else:
+            # Further off than the wheel reaches, so park it in the furthest
+            # slot, from where it will be placed again when it comes round.
+            place = self.current + self.horizon
+        slot = (place // self.spans[level]) % self.slots
+        self.wheel[level][slot][key] = tick
+        self.timers[key] = (level, slot)
+
+    def advance(self, now):
+        '''Moves the wheel on to now, returning a list of every key whose
+        deadline has come. Their deadlines are removed.'''
+        target = int((now - self.origin) // self.resolution)
+        expired = []
+        if not self.timers:
+            self.current = max(self.current, target)
+            return expired
+        while self.current < target:
+            self.current += 1
+            slot = self.current % self.slots
+            if not slot:
+                self.cascade(1)
+            due = self.wheel[0][slot]
+            if due:
+                self.wheel[0][slot] = {}
+                for key, tick in due.items():
+                    if tick > self.current:
+                        # Parked, with only one level to park in.
+                        self.insert(key, tick)
+                    else:
+                        del self.timers[key]
+                        expired.append(key)
+            if not self.timers:
+                self.current = target
+        return expired
+
+    def cascade(self, level):
+        '''Spreads the slot of `level` whose turn has come over the levels
+        below, having first done the same for the level above if it too
+        has come round.'''
+        if level >= self.levels:
+            return
+        slot = (self.current // self.spans[level]) % self.slots
+        if not slot:
+            self.cascade(level + 1)
+        due = self.wheel[level][slot]
+        if due:
+            self.wheel[level][slot] = {}
+            for key, tick in due.items():
+                self.insert(key, tick)
@@ -12,5 +12,6 @@ setup(
     url='https://github.com/theelous3/noio_ws',
     packages=['noio_ws'],
     install_requires=['h11'],
+    extras_require={'numpy': ['numpy']},
     classifiers=['Programming Language :: Python :: 3']
 )
@@ -0,0 +1,5 @@
+# The other scripts in tests/ are worked examples rather than tests, and
+# tests/junk predates the current API.
+collect_ignore = ['minimal_client_server.py',
+                  'minimal_client_server_extension_and_opcode_modified.py']
+collect_ignore_glob = ['junk/*']
@@ -50,7 +50,7 @@ class WsClient:
 
     def ws_send(self, message, type, fin=True, status_code=None):
         self.sock.sendall(
-            self.ws_conn.send(ws.Data(message, type, fin, status_code)))
+            self.ws_conn.send(ws.SendFrame(message, type, fin, status_code)))
 
     def next_event(self):
         while True:
@@ -119,7 +119,7 @@ class WsClientHandler:
 
     def ws_send(self, message, type, fin=True, status_code=None):
         self.sock.sendall(
-            ws_conn.send(ws.Data(message, type, fin, status_code)))
+            ws_conn.send(ws.SendFrame(message, type, fin, status_code)))
 
     def next_event(self):
         while True:
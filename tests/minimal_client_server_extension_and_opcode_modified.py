@@ -14,6 +14,10 @@ It also gives an example of:
     3. Adding one custom control type opcode "compare".
 
 Note: We will use our deflate extension on all frames of type "latin_1".
+This hand rolled compression is only an example of using the reserved
+bits, it is not the standard permessage-deflate extension. For that,
+negotiate it with Handshake(..., deflate=True) and pass Handshake.deflate
+to the Connection.
 '''
 
 import noio_ws as ws
@@ -0,0 +1,84 @@
+import os
+import tracemalloc
+
+import pytest
+
+import noio_ws as ws
+
+FRAME_SIZE = 16
+# Room for the odd transient object made while a frame is parsed, such as
+# deque bookkeeping. A copy of even a small payload costs more than this.
+SLACK = 32
+
+
+def small_frame():
+    server = ws.Connection('SERVER')
+    return server.send(ws.SendFrame(os.urandom(FRAME_SIZE), 'binary'))
+
+
+def event_cost(count):
+    '''The average peak memory of making the delivered event and its
+    payload, and nothing else.'''
+    buffer = bytearray(64)
+    total = 0
+    for _ in range(count):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        event = ws.ReceivedFrame(True, buffer[2:2 + FRAME_SIZE], 'binary',
+                                 0, None)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - before
+        del event
+    return total / count
+
+
+def peak_per_frame(conn, frame, count):
+    '''The average peak memory allocated while one frame is parsed.'''
+    total = 0
+    for _ in range(count):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        conn.recv(frame)
+        event = conn.next_event()
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - before
+        del event
+    return total / count
+
+
+@pytest.fixture
+def traced():
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def test_parser_is_reused():
+    conn = ws.Connection('CLIENT')
+    frame = small_frame()
+    conn.recv(frame)
+    conn.next_event()
+    parser = conn.recvr.parser
+    for _ in range(10):
+        conn.recv(frame)
+        conn.next_event()
+    assert conn.recvr.parser is parser
+
+
+def test_small_frames_allocate_only_the_event(traced):
+    conn = ws.Connection('CLIENT', timestamps=False)
+    frame = small_frame()
+    # Warm up, so the buffer has grown to size.
+    peak_per_frame(conn, frame, 10)
+    per_frame = peak_per_frame(conn, frame, 1000)
+    assert per_frame <= event_cost(1000) + SLACK
+
+
+def test_small_frames_leave_nothing_behind(traced):
+    conn = ws.Connection('CLIENT', timestamps=False)
+    frame = small_frame()
+    peak_per_frame(conn, frame, 10)
+    before, _ = tracemalloc.get_traced_memory()
+    peak_per_frame(conn, frame, 1000)
+    after, _ = tracemalloc.get_traced_memory()
+    assert after - before < 1024
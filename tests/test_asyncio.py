@@ -0,0 +1,137 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+import noio_ws as ws
+from noio_ws.asyncio import connect, serve
+
+
+async def echo(sock):
+    async for message in sock:
+        await sock.send(message)
+
+
+def with_server(handler, **kwargs):
+    '''Decorates a coroutine function taking a port, running it against a
+    server started with handler and kwargs.'''
+    def decorator(test):
+        async def run():
+            server = await serve(handler, '127.0.0.1', 0, **kwargs)
+            try:
+                return await test(server.sockets[0].getsockname()[1])
+            finally:
+                server.close()
+                await server.wait_closed()
+        return run
+    return decorator
+
+
+@pytest.mark.parametrize('deflate', [False, True])
+def test_echo(deflate):
+    big = os.urandom(5000000)
+
+    @with_server(echo, deflate=deflate, subprotocols=['chat'])
+    async def run(port):
+        client = await connect('ws://127.0.0.1:{}/path'.format(port),
+                               deflate=deflate, subprotocols=['chat'])
+        assert client.subprotocol == 'chat'
+        assert (client.conn.deflate is not None) == deflate
+        await client.send('hello é')
+        assert await client.recv() == 'hello é'
+        await client.send(big)
+        assert bytes(await client.recv()) == big
+        for i in range(1000):
+            await client.send(b'x%d' % i)
+        assert [bytes(await client.recv()) for _ in range(1000)] == \
+            [b'x%d' % i for i in range(1000)]
+        await client.close()
+        assert client.close_code == 1000 and client.closed
+        with pytest.raises(ws.NnwsConnectionClosed):
+            await client.send('x')
+
+    asyncio.run(run())
+
+
+def test_fragmented_sends():
+    got = []
+    big = os.urandom(1 << 20)
+
+    async def collect(sock):
+        async for message in sock:
+            got.append(message)
+
+    @with_server(collect)
+    async def run(port):
+        client = await connect('ws://127.0.0.1:{}/'.format(port),
+                               max_frame_size=4096)
+
+        async def pings():
+            for _ in range(5):
+                await client.ping(b'x')
+                await asyncio.sleep(0)
+
+        await asyncio.gather(client.send(big), pings(), client.send('small'))
+        await client.send(io.BytesIO(b'f' * 10000))
+        await client.send_fragments(iter(['a', 'b']), 'text')
+        await client.close()
+
+    asyncio.run(run())
+    assert bytes(got[0]) == big
+    assert got[1:] == ['small', b'f' * 10000, 'ab']
+
+
+def test_bad_request():
+    @with_server(echo)
+    async def run(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET / HTTP/1.1\r\nhost: x\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        return response
+
+    assert asyncio.run(run()).startswith(b'HTTP/1.1 400')
+
+
+def test_messages_before_an_error_are_received():
+    got = []
+
+    async def collect(sock):
+        try:
+            async for message in sock:
+                got.append(message)
+        except ws.NnwsProtocolError as e:
+            got.append(e.status_code)
+
+    @with_server(collect)
+    async def run(port):
+        client = await connect('ws://127.0.0.1:{}/'.format(port))
+        raw = ws.Connection('CLIENT')
+        # Both messages and the bad frame arrive in one chunk.
+        client.transport.write(raw.send(ws.SendFrame('one', 'text')) +
+                               raw.send(ws.SendFrame(b'two', 'binary')) +
+                               b'\x09\x81' + bytes(5))
+        await asyncio.wait_for(client.lost, 5)
+
+    asyncio.run(run())
+    assert got == ['one', b'two', 1002]
+
+
+def test_spilled_text():
+    got = []
+    text = 'é' * 100000
+
+    async def collect(sock):
+        async for message in sock:
+            got.append(message.read().decode())
+
+    @with_server(collect, spill_threshold=1000)
+    async def run(port):
+        client = await connect('ws://127.0.0.1:{}/'.format(port),
+                               max_frame_size=4096)
+        await client.send(text)
+        await client.close()
+
+    asyncio.run(run())
+    assert got == [text]
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import noio_ws as ws
+from noio_ws.asyncio import connect, serve
+
+
+async def close_with(payload=None, code=None):
+    '''Closes a client's connection to a server with either a close code
+    or a raw close payload, returning the code the client got back and the
+    code the server saw.'''
+    seen = []
+
+    async def handler(sock):
+        try:
+            async for _ in sock:
+                pass
+        except ws.NnwsProtocolError:
+            pass
+        seen.append(sock.close_code)
+
+    server = await serve(handler, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await connect('ws://127.0.0.1:{}/'.format(port))
+    if payload is None:
+        await client.close(code)
+    else:
+        # Sent raw, as SendFrame won't make a bad close frame.
+        client.transport.write(ws.Connection('CLIENT').send(
+            ws.SendFrame(payload, 'close')))
+        await asyncio.wait_for(client.lost, 5)
+    server.close()
+    await server.wait_closed()
+    return client.close_code, seen[0]
+
+
+@pytest.mark.parametrize('code', [1000, 1001, 1011, 3000, 4999])
+def test_valid_close_code_is_echoed(code):
+    assert asyncio.run(close_with(code=code)) == (code, code)
+
+
+@pytest.mark.parametrize('code', [999, 1004, 1005, 1006, 1015, 2000, 5000])
+def test_invalid_close_code_fails_with_1002(code):
+    payload = code.to_bytes(2, 'big')
+    assert asyncio.run(close_with(payload)) == (1002, 1002)
+
+
+def test_one_byte_close_payload_fails_with_1002():
+    assert asyncio.run(close_with(b'\x03')) == (1002, 1002)
+
+
+def test_close_reason():
+    payload = (1000).to_bytes(2, 'big') + 'done ✓'.encode()
+    assert asyncio.run(close_with(payload)) == (1000, 1000)
+
+
+def test_invalid_utf8_close_reason_fails_with_1007():
+    payload = (1000).to_bytes(2, 'big') + b'bad \xff'
+    assert asyncio.run(close_with(payload)) == (1007, 1007)
+
+
+def test_empty_close_is_answered():
+    assert asyncio.run(close_with(b'')) == (1005, 1005)
+
+
+@pytest.mark.parametrize('code', [1004, 1005, 1006, 1015, 2999, 5000])
+def test_send_frame_rejects_unsendable_codes(code):
+    with pytest.raises(ValueError):
+        ws.Connection('SERVER').send(
+            ws.SendFrame(b'', 'close', status_code=code))
+
+
+@pytest.mark.parametrize('code', [1000, 1014, 3000, 4000, 4999])
+def test_send_frame_accepts_sendable_codes(code):
+    ws.Connection('SERVER').send(ws.SendFrame(b'', 'close', status_code=code))
@@ -0,0 +1,40 @@
+import asyncio
+
+from noio_ws import Information
+from noio_ws.asyncio import connect, serve
+
+
+async def count_pings(interval, timeout, duration):
+    '''Counts the keepalive pings a client sends a server in duration
+    seconds.'''
+    pings = 0
+
+    async def handler(sock):
+        async for _ in sock:
+            pass
+
+    server = await serve(handler, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await connect('ws://127.0.0.1:{}/'.format(port),
+                           ping_interval=interval, ping_timeout=timeout)
+    tick = client.conn.tick
+
+    def counting_tick(now=None):
+        nonlocal pings
+        result = tick(now)
+        if result is Information.SEND_PING:
+            pings += 1
+        return result
+
+    client.conn.tick = counting_tick
+    await asyncio.sleep(duration)
+    await client.close()
+    server.close()
+    await server.wait_closed()
+    return pings
+
+
+def test_pings_follow_the_interval_when_the_timeout_is_longer():
+    # One ping every 0.05s for 0.5s, not one every timeout.
+    pings = asyncio.run(count_pings(0.05, 1.0, 0.5))
+    assert 7 <= pings <= 10
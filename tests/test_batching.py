@@ -0,0 +1,66 @@
+import noio_ws as ws
+from noio_ws.batching import FrameBatcher
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def batcher(**kwargs):
+    clock = Clock(0.0)
+    writes = []
+    conn = ws.Connection('SERVER', clock=clock, auto_pong=True)
+    return FrameBatcher(conn, writes.append, **kwargs), clock, writes
+
+
+def received(writes):
+    conn = ws.Connection('CLIENT')
+    conn.recv(b''.join(writes))
+    return [bytes(event.payload) for event in conn.events()]
+
+
+def test_written_at_max_delay():
+    frames, clock, writes = batcher(max_delay=0.005)
+    assert frames.deadline() is None
+    for i in range(10):
+        frames.send(ws.SendFrame(b'%d' % i, 'text'))
+    assert writes == [] and frames.deadline() == 0.005
+    clock.now = 0.004
+    frames.tick()
+    assert writes == []
+    frames.tick(0.005)
+    assert len(writes) == 1
+    assert received(writes) == [b'%d' % i for i in range(10)]
+    assert frames.deadline() is None and len(frames) == 0
+
+
+def test_written_at_max_bytes():
+    frames, _, writes = batcher(max_bytes=100)
+    for i in range(12):
+        frames.send(ws.SendFrame(b'x' * 10, 'binary'))
+    # Written out by the ninth 12 byte frame, leaving three queued.
+    assert [len(write) for write in writes] == [108]
+    assert len(frames) == 36
+
+
+def test_flush():
+    frames, _, writes = batcher()
+    frames.send(ws.SendFrame(b'a', 'text'))
+    frames.send(ws.SendFrame(b'b', 'text'), flush=True)
+    assert received(writes) == [b'a', b'b']
+    frames.flush()
+    assert len(writes) == 1
+
+
+def test_pongs_are_batched():
+    frames, clock, writes = batcher()
+    frames.conn.recv(ws.Connection('CLIENT').send(ws.SendFrame(b'p', 'ping')))
+    frames.conn.next_event()
+    clock.now = 1
+    assert frames.deadline() == 1.005
+    frames.tick(2)
+    assert writes == [b'\x8a\x01p']
@@ -0,0 +1,151 @@
+import tracemalloc
+
+import h11
+import pytest
+
+import noio_ws as ws
+from noio_ws.handshake_utils import Handshake
+
+
+MESSAGES = ['{"hello": "world"}' * 50, '', 'x', 'ünïcode' * 100]
+
+
+def negotiate(client_options, server_options):
+    '''Runs a handshake through h11, returning the PerMessageDeflate each
+    side ended up with.'''
+    client, server = Handshake('CLIENT'), Handshake('SERVER')
+    client_http, server_http = h11.Connection(h11.CLIENT), \
+        h11.Connection(h11.SERVER)
+    server_http.receive_data(
+        client_http.send(client.client_handshake('ws://localhost/',
+                                                 deflate=client_options)) +
+        client_http.send(h11.EndOfMessage()))
+    server.verify_request(server_http.next_event())
+    client_http.receive_data(server_http.send(
+        server.server_handshake(deflate=server_options)))
+    client.verify_response(client_http.next_event())
+    return client.deflate, server.deflate
+
+
+@pytest.mark.parametrize('client_options, server_options', [
+    (True, True),
+    ({'client_no_context_takeover': True, 'server_max_window_bits': 10},
+     {'server_no_context_takeover': True, 'client_max_window_bits': 12}),
+])
+def test_negotiated_round_trip(client_options, server_options):
+    client_deflate, server_deflate = negotiate(client_options, server_options)
+    client = ws.Connection('CLIENT', deflate=client_deflate, decode_text=True)
+    server = ws.Connection('SERVER', deflate=server_deflate,
+                           full_message=True, decode_text=True)
+
+    data = b''.join(server.send(ws.SendFrame(message, 'text'))
+                    for message in MESSAGES)
+    assert len(data) < sum(len(message.encode()) for message in MESSAGES)
+    client.recv(data)
+    assert [event.decoded_text for event in client.events()] == MESSAGES
+
+    server.recv(client.send(ws.SendFrame('abc' * 100, 'text', fin=False)) +
+                client.send(ws.SendFrame('p', 'ping')) +
+                client.send(ws.SendFrame('def' * 100, 'continue')) +
+                client.send(ws.SendFrame(b'raw', 'binary', compress=False)))
+    events = list(server.events())
+    assert [event.f_type for event in events] == ['ping', 'text', 'binary']
+    assert events[1].decoded_text == 'abc' * 100 + 'def' * 100
+    assert bytes(events[2].payload) == b'raw'
+
+
+@pytest.mark.parametrize('client_options, server_options', [
+    (False, True),
+    (True, False),
+])
+def test_not_negotiated(client_options, server_options):
+    assert negotiate(client_options, server_options) == (None, None)
+
+
+def test_reserved_bits_left_alone_without_extension():
+    # Without the extension, reserved bits are the application's to handle.
+    data = ws.Connection('SERVER', deflate=ws.PerMessageDeflate('SERVER'))\
+        .send(ws.SendFrame(b'x' * 100, 'binary'))
+    conn = ws.Connection('CLIENT')
+    conn.recv(data)
+    event = conn.next_event()
+    assert event.reserved[0] and bytes(event.payload) != b'x' * 100
+
+
+MiB = 1 << 20
+
+
+def compressed(payload, **kwargs):
+    return ws.Connection('CLIENT', deflate=ws.PerMessageDeflate('CLIENT'))\
+        .send(ws.SendFrame(payload, 'binary', **kwargs))
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'full_message': True},
+                                    {'stream': True}])
+def test_decompression_bomb(kwargs):
+    data = compressed(bytes(30 * MiB))
+    assert len(data) < MiB
+    conn = ws.Connection('SERVER', deflate=ws.PerMessageDeflate('SERVER'),
+                         max_inflated=MiB, **kwargs)
+    tracemalloc.start()
+    try:
+        with pytest.raises(ws.NnwsMessageTooBigError) as e:
+            conn.recv(data)
+            list(conn.events())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert e.value.status_code == 1009
+    assert peak < 4 * MiB
+
+
+def test_fragmented_message_over_max_inflated():
+    conn = ws.Connection('CLIENT', deflate=ws.PerMessageDeflate('CLIENT'))
+    data = (conn.send(ws.SendFrame(bytes(MiB // 2), 'binary', fin=False)) +
+            conn.send(ws.SendFrame(bytes(MiB // 2), 'continue', fin=False)) +
+            conn.send(ws.SendFrame(bytes(MiB // 2), 'continue')))
+    server = ws.Connection('SERVER', deflate=ws.PerMessageDeflate('SERVER'),
+                           max_inflated=MiB, full_message=True)
+    with pytest.raises(ws.NnwsMessageTooBigError):
+        server.recv(data)
+        list(server.events())
+
+
+def test_within_max_inflated():
+    conn = ws.Connection('SERVER', deflate=ws.PerMessageDeflate('SERVER'),
+                         max_inflated=MiB)
+    conn.recv(compressed(bytes(MiB)))
+    assert bytes(conn.next_event().payload) == bytes(MiB)
+
+
+BROADCAST = '{"price": 1.2345, "sym": "ABC"}' * 20
+
+
+def test_prepared_frame_broadcast():
+    pool = ws.CompressorPool()
+    servers = [ws.Connection('SERVER', deflate=ws.PerMessageDeflate(
+        'SERVER', server_no_context_takeover=True, pool=pool))
+        for _ in range(3)]
+    servers += [ws.Connection('SERVER'),
+                ws.Connection('SERVER', deflate=ws.PerMessageDeflate('SERVER'))]
+    clients = [ws.Connection('CLIENT', deflate=ws.PerMessageDeflate(
+        'CLIENT', server_no_context_takeover=True)) for _ in range(3)]
+    clients += [ws.Connection('CLIENT'),
+                ws.Connection('CLIENT', deflate=ws.PerMessageDeflate('CLIENT'))]
+    prepared = servers[0].prepare(ws.SendFrame(BROADCAST, 'text'))
+    for _ in range(3):
+        for server, client in zip(servers, clients):
+            client.recv(server.send(prepared))
+            assert bytes(client.next_event().payload) == BROADCAST.encode()
+            # Ordinary sends still work around the shared compressors.
+            client.recv(server.send(ws.SendFrame('other' * 10, 'text')))
+            assert bytes(client.next_event().payload) == b'other' * 10
+    # One compressed variant shared by the no context takeover connections,
+    # and one uncompressed.
+    assert len(prepared.encoded) == 2
+
+
+def test_prepared_frames_are_for_servers():
+    prepared = ws.PreparedFrame(ws.SendFrame(b'x', 'binary'))
+    with pytest.raises(ws.NnwsProtocolError):
+        ws.Connection('CLIENT').send(prepared)
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+import noio_ws as ws
+
+
+def received(data, **kwargs):
+    conn = ws.Connection('CLIENT', **kwargs)
+    conn.recv(data)
+    return list(conn.events())
+
+
+def test_timestamps():
+    before = time.monotonic_ns()
+    event, = received(b'\x82\x01x')
+    assert before <= event.time <= time.monotonic_ns()
+    event, = received(b'\x82\x01x', timestamps=False)
+    assert event.time is None
+
+
+@pytest.mark.parametrize('data, kwargs, cls', [
+    (b'\x82\x01x', {}, ws.ReceivedFrame),
+    (b'\x82\x01x', {'full_message': True}, ws.Message),
+    (b'\x89\x01x', {}, ws.ControlMessage),
+    (b'\x82\x01x', {'stream': True}, ws.PayloadChunk),
+])
+def test_events_are_slotted(data, kwargs, cls):
+    event, = received(data, **kwargs)
+    assert type(event) is cls
+    assert not hasattr(event, '__dict__')
+
+
+def test_data_hands_over_the_payload():
+    event, = received(b'\x82\x01x')
+    assert event.data == b'x'
+    assert event.payload == b''
@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+
+import noio_ws as ws
+from noio_ws.asyncio import connect, serve
+
+
+DATA = os.urandom(3 << 20)
+
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('file_frame') / 'data'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+def test_round_trip(path, role, peer):
+    sender, receiver = ws.Connection(role), ws.Connection(peer)
+    with ws.FileFrame(path, 70000, 1000000) as frame:
+        receiver.recv(bytes(sender.send(frame)))
+        header, payload = sender.send_buffers(frame)
+        receiver.recv(bytes(header) + bytes(payload))
+    expected = DATA[70000:1070000]
+    assert [bytes(event.payload) for event in receiver.events()] == \
+        [expected, expected]
+
+
+def test_send_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        header, file, offset, length = ws.Connection('SERVER').send_file(
+            ws.FileFrame(fd, 5))
+        assert (offset, length) == (5, len(DATA) - 5)
+        assert file.fileno() == fd
+    finally:
+        os.close(fd)
+    receiver = ws.Connection('CLIENT')
+    receiver.recv(header + DATA[5:])
+    assert bytes(receiver.next_event().payload) == DATA[5:]
+
+
+def test_send_file_is_for_servers(path):
+    with ws.FileFrame(path) as frame:
+        with pytest.raises(ws.NnwsProtocolError):
+            ws.Connection('CLIENT').send_file(frame)
+
+
+def test_out_of_bounds(path):
+    with pytest.raises(ValueError):
+        ws.FileFrame(path, 10, len(DATA))
+
+
+def test_empty_range(path):
+    with ws.FileFrame(path, len(DATA)) as frame:
+        assert bytes(ws.Connection('SERVER').send(frame)) == b'\x82\x00'
+
+
+def test_closes_only_what_it_opened(path):
+    with open(path, 'rb') as f:
+        with ws.FileFrame(f, 0, 10):
+            pass
+        assert not f.closed
+    with ws.FileFrame(path, 0, 10) as frame:
+        pass
+    assert frame.file.closed
+
+
+async def serve_file(path, fallback):
+    async def handler(sock):
+        if fallback:
+            async def no_sendfile(*args, **kwargs):
+                raise asyncio.SendfileNotAvailableError
+            sock.loop.sendfile = no_sendfile
+        with ws.FileFrame(path) as frame:
+            await asyncio.gather(sock.send(frame), sock.ping(b'p'))
+        await sock.send('after')
+        async for _ in sock:
+            pass
+
+    server = await serve(handler, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await connect('ws://127.0.0.1:{}/'.format(port))
+    received = [await client.recv(), await client.recv()]
+    await client.close()
+    server.close()
+    await server.wait_closed()
+    return received
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+def test_asyncio_send_file(path, fallback):
+    payload, after = asyncio.run(serve_file(path, fallback))
+    assert bytes(payload) == DATA
+    assert after == 'after'
@@ -0,0 +1,90 @@
+import io
+import os
+
+import pytest
+
+import noio_ws as ws
+from noio_ws.connection import split_payload
+
+
+@pytest.mark.parametrize('size', [1, 4, 5, 6, 10, 11])
+@pytest.mark.parametrize('source', [
+    bytes,
+    lambda data: [data[:3], data[3:]],
+    io.BytesIO,
+])
+def test_split_payload(size, source):
+    data = os.urandom(size)
+    pieces = [bytes(piece) for piece in split_payload(source(data), 5)]
+    assert b''.join(pieces) == data
+    assert all(len(piece) == 5 for piece in pieces[:-1])
+    assert 0 < len(pieces[-1]) <= 5
+
+
+def test_split_empty_payload():
+    assert [bytes(piece) for piece in split_payload(b'', 5)] == [b'']
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+@pytest.mark.parametrize('deflate', [False, True])
+def test_round_trip(role, peer, deflate):
+    extension = {}
+    peer_extension = {}
+    if deflate:
+        extension = {'deflate': ws.PerMessageDeflate(role)}
+        peer_extension = {'deflate': ws.PerMessageDeflate(peer)}
+    sender = ws.Connection(role, max_frame_size=1000, **extension)
+    receiver = ws.Connection(peer, full_message=True, **peer_extension)
+    payload = os.urandom(5000) + b'a' * 20000
+
+    data = b''
+    frames = 0
+    for frames, frame in enumerate(sender.send_fragments(
+            io.BytesIO(payload)), 1):
+        data += frame
+        if frames == 3:
+            # Control frames can go out between the fragments.
+            data += sender.send(ws.SendFrame(b'hb', 'ping'))
+    assert frames == 25
+    receiver.recv(data)
+    events = list(receiver.events())
+    assert [event.f_type for event in events] == ['ping', 'binary']
+    assert bytes(events[1].payload) == payload
+
+
+def test_text_split_mid_character():
+    text = ''.join(chr(0x4e00 + i) for i in range(3000))
+    receiver = ws.Connection('SERVER', full_message=True, decode_text=True)
+    receiver.recv(b''.join(ws.Connection('CLIENT').send_fragments(
+        text, 'text', max_frame_size=7)))
+    assert receiver.next_event().decoded_text == text
+
+
+def test_control_frames_cannot_be_fragmented():
+    with pytest.raises(ws.NnwsProtocolError):
+        list(ws.Connection('SERVER').send_fragments(b'x', 'ping'))
+
+
+@pytest.mark.parametrize('send', [
+    lambda conn: conn.send(ws.SendFrame(b'x', 'binary')),
+    lambda conn: conn.send_buffers(ws.SendFrame('x', 'text')),
+    lambda conn: conn.write(ws.PreparedFrame(ws.SendFrame(b'x', 'binary'))),
+    lambda conn: conn.send_many([(b'x', 'binary')]),
+    lambda conn: list(conn.send_fragments(b'x')),
+])
+def test_data_frames_cannot_interleave(send):
+    conn = ws.Connection('SERVER', max_frame_size=2)
+    fragments = conn.send_fragments(b'abcdef')
+    data = next(fragments)
+    with pytest.raises(ws.NnwsProtocolError):
+        send(conn)
+    data += conn.send(ws.SendFrame(b'p', 'ping')) + b''.join(fragments)
+    # Once the message is finished, data frames can go again.
+    data += conn.send(ws.SendFrame(b'x', 'binary'))
+    receiver = ws.Connection('CLIENT', full_message=True)
+    receiver.recv(data)
+    assert [(event.f_type, bytes(event.payload))
+            for event in receiver.events()] == [('ping', b'p'),
+                                                ('binary', b'abcdef'),
+                                                ('binary', b'x')]
@@ -0,0 +1,77 @@
+from array import array
+import os
+import struct
+
+import pytest
+
+import noio_ws as ws
+
+
+def reference_header(fin, opcode, length, masked=False):
+    '''Packs a header the long way round.'''
+    byte_0 = fin << 7 | opcode
+    if length <= 125:
+        return struct.pack('!BB', byte_0, masked << 7 | length)
+    if length <= 65535:
+        return struct.pack('!BBH', byte_0, masked << 7 | 126, length)
+    return struct.pack('!BBQ', byte_0, masked << 7 | 127, length)
+
+
+@pytest.mark.parametrize('size', [0, 1, 125, 126, 65535, 65536, 70000])
+@pytest.mark.parametrize('f_type, opcode', [('text', 1), ('binary', 2)])
+@pytest.mark.parametrize('fin', [True, False])
+def test_server_headers(size, f_type, opcode, fin):
+    payload = b'x' * size
+    data = ws.Connection('SERVER').send(ws.SendFrame(payload, f_type, fin=fin))
+    assert bytes(data) == reference_header(fin, opcode, size) + payload
+
+
+@pytest.mark.parametrize('size', [0, 125, 126, 65536])
+def test_client_headers(size):
+    data = ws.Connection('CLIENT').send(ws.SendFrame(b'x' * size, 'binary'))
+    header = reference_header(True, 2, size, masked=True)
+    assert bytes(data[:len(header)]) == header
+    # Followed by the mask and the masked payload.
+    assert len(data) == len(header) + 4 + size
+
+
+def test_short_headers_are_cached():
+    conn = ws.Connection('SERVER')
+    optable = conn.optable
+    assert optable.header(0x81, 5, False) is optable.header(0x81, 5, False)
+    assert optable.header(0x81, 500, False) == b'\x81\x7e\x01\xf4'
+
+
+@pytest.mark.parametrize('size', [0, 5, 126, 70000])
+def test_send_buffers(size):
+    payload = os.urandom(size)
+    for role, peer in (('SERVER', 'CLIENT'), ('CLIENT', 'SERVER')):
+        header, body = ws.Connection(role).send_buffers(
+            ws.SendFrame(payload, 'binary'))
+        if role == 'SERVER':
+            # Not copied.
+            assert isinstance(body, memoryview) and body.obj is payload
+        receiver = ws.Connection(peer)
+        receiver.recv(bytes(header) + bytes(body))
+        assert bytes(receiver.next_event().payload) == payload
+
+
+def test_send_buffers_leaves_data_unmasked():
+    payload = bytearray(b'abcd' * 10)
+    ws.Connection('CLIENT').send_buffers(ws.SendFrame(payload, 'binary'))
+    assert payload == b'abcd' * 10
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+def test_non_byte_memoryview(role, peer):
+    payload = array('H', range(0, 65536, 3))
+    expected = payload.tobytes()
+    sender = ws.Connection(role)
+    receiver = ws.Connection(peer)
+    receiver.recv(sender.send(ws.SendFrame(memoryview(payload), 'binary')))
+    header, body = sender.send_buffers(ws.SendFrame(memoryview(payload),
+                                                    'binary'))
+    receiver.recv(bytes(header) + bytes(body))
+    assert [bytes(event.payload) for event in receiver.events()] == \
+        [expected, expected]
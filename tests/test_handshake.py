@@ -0,0 +1,50 @@
+import h11
+import pytest
+
+from noio_ws.errors import NnwsProtocolError
+from noio_ws.handshake_utils import Handshake
+
+
+def request(connection, upgrade='websocket'):
+    return h11.Request(method='GET', target='/', headers=[
+        ('Host', 'example.com'),
+        ('Connection', connection),
+        ('Upgrade', upgrade),
+        ('Sec-WebSocket-Key', 'dGhlIHNhbXBsZSBub25jZQ=='),
+        ('Sec-WebSocket-Version', '13')])
+
+
+@pytest.mark.parametrize('connection, upgrade', [
+    ('upgrade', 'websocket'),
+    # What the websockets library sends.
+    ('Upgrade', 'websocket'),
+    # What Firefox sends.
+    ('keep-alive, Upgrade', 'websocket'),
+    ('Upgrade', 'WebSocket'),
+])
+def test_request_headers_accepted(connection, upgrade):
+    Handshake('SERVER').verify_request(request(connection, upgrade))
+
+
+@pytest.mark.parametrize('connection, upgrade', [
+    ('keep-alive', 'websocket'),
+    ('upgrades', 'websocket'),
+    ('Upgrade', 'h2c'),
+])
+def test_request_headers_rejected(connection, upgrade):
+    with pytest.raises(NnwsProtocolError):
+        Handshake('SERVER').verify_request(request(connection, upgrade))
+
+
+def test_response_connection_header_tokens():
+    client = Handshake('CLIENT')
+    client.client_handshake('ws://example.com/')
+    server = Handshake('SERVER')
+    server.verify_request(request('Upgrade'))
+    response = server.server_handshake()
+    headers = [(k, b'keep-alive, Upgrade' if k.lower() == b'connection'
+                else v) for k, v in response.headers]
+    server_nonce = server.nonce
+    client.nonce = server_nonce
+    client.verify_response(h11.InformationalResponse(
+        status_code=101, headers=headers))
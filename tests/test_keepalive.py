@@ -0,0 +1,96 @@
+import pytest
+
+import noio_ws as ws
+from noio_ws.constants import CStates
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock(100.0)
+
+
+def test_ping_pong(clock):
+    client = ws.Connection('CLIENT', keepalive=ws.Keepalive(10, 3),
+                           clock=clock)
+    server = ws.Connection('SERVER', auto_pong=True)
+    assert client.next_deadline() == 110
+    assert client.tick(105) is None
+    assert client.tick(110) is ws.Information.SEND_PING
+    # Waiting on the pong now.
+    assert client.next_deadline() == 113
+
+    server.recv(client.data_to_send())
+    assert server.next_event().f_type == 'ping'
+    clock.now = 110.5
+    client.recv(server.data_to_send())
+    assert client.next_event().f_type == 'pong'
+    assert client.rtt == 0.5
+    # Scheduled from when the ping was sent, not when its pong came.
+    assert client.next_deadline() == 120
+
+
+def test_missing_pong(clock):
+    client = ws.Connection('CLIENT', keepalive=ws.Keepalive(10, 3),
+                           clock=clock)
+    assert client.tick(110) is ws.Information.SEND_PING
+    assert client.tick(112) is None
+    assert client.tick(113) is ws.Information.CONNECTION_CLOSED
+    assert client.state is CStates.CLOSED
+
+
+def test_unsolicited_pong_ignored(clock):
+    client = ws.Connection('CLIENT', keepalive=ws.Keepalive(10, 3),
+                           clock=clock)
+    client.tick(110)
+    client.recv(ws.Connection('SERVER').send(ws.SendFrame(b'nope', 'pong')))
+    client.next_event()
+    assert client.rtt is None
+    assert client.next_deadline() == 113
+
+
+def test_auto_pong():
+    server = ws.Connection('SERVER', auto_pong=True)
+    server.recv(ws.Connection('CLIENT').send(ws.SendFrame(b'x', 'ping')))
+    server.next_event()
+    assert server.data_to_send() == b'\x8a\x01x'
+
+
+@pytest.mark.parametrize('header', [
+    # A ping with a 200 byte payload.
+    b'\x89\x7e\x00\xc8',
+    # A ping without fin set.
+    b'\x09\x01',
+])
+@pytest.mark.parametrize('kwargs', [{}, {'stream': True}])
+def test_bad_ping_fails_the_connection(header, kwargs):
+    conn = ws.Connection('CLIENT', auto_pong=True, **kwargs)
+    # Failed on the header alone, before any of the payload arrives.
+    with pytest.raises(ws.NnwsProtocolError) as e:
+        conn.recv(header)
+    assert e.value.status_code == 1002
+    assert conn.data_to_send() == b''
+
+
+def test_close_timeout(clock):
+    conn = ws.Connection('CLIENT', close_timeout=5, clock=clock)
+    conn.send(ws.SendFrame(b'', 'close', status_code=1000))
+    assert conn.state is CStates.CLOSING
+    assert conn.next_deadline() == 105
+    assert conn.tick(104) is None
+    assert conn.tick(105) is ws.Information.CONNECTION_CLOSED
+    assert conn.state is CStates.CLOSED
+
+
+def test_no_keepalive():
+    conn = ws.Connection('CLIENT')
+    assert conn.next_deadline() is None
+    assert conn.tick() is None
+    assert conn.rtt is None
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from noio_ws import masking
+
+
+MASK = b'\x01\x23\x45\x67'
+
+
+@pytest.mark.parametrize('backend', sorted(masking.BACKENDS))
+@pytest.mark.parametrize('size', [0, 1, 3, 4, 5, 1023, 1024, 1027, 70000])
+@pytest.mark.parametrize('offset', [0, 1, 2, 3, 5])
+def test_backends_match_the_loop(backend, size, offset):
+    data = os.urandom(size)
+    expected = masking.mask_loop(bytearray(data), MASK, offset)
+    assert masking.BACKENDS[backend](bytearray(data), MASK, offset) == expected
+
+
+def test_bytes_are_copied():
+    data = os.urandom(2000)
+    masked = masking.mask_unmask(data, MASK)
+    assert isinstance(masked, bytearray)
+    assert masking.mask_unmask(masked, MASK) == data
+
+
+def test_in_pieces():
+    data = os.urandom(1001)
+    whole = masking.mask_unmask(bytearray(data), MASK)
+    pieces = (masking.mask_unmask(bytearray(data[:7]), MASK) +
+              masking.mask_unmask(bytearray(data[7:]), MASK, 7))
+    assert pieces == whole
+
+
+@pytest.mark.parametrize('size', [20, 5000])
+def test_mask_regions(size):
+    data = bytearray(os.urandom(size))
+    regions = [(2, 5, MASK), (9, size - 12, b'\xff\x00\xaa\x55')]
+    expected = bytearray(data)
+    for offset, length, mask in regions:
+        expected[offset:offset + length] = masking.mask_loop(
+            expected[offset:offset + length], mask)
+    assert masking.mask_regions(data, regions) == expected
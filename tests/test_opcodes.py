@@ -0,0 +1,42 @@
+import pytest
+
+import noio_ws as ws
+
+
+def custom(role):
+    return ws.Connection(role, opcode_non_control_mod={3: 'latin_1'},
+                         opcode_control_mod={11: 'compare'})
+
+
+def test_custom_opcodes():
+    server, client = custom('SERVER'), custom('CLIENT')
+    client.recv(server.send(ws.SendFrame(b'caf\xe9', 'latin_1')) +
+                server.send(ws.SendFrame(b'c', 'compare')))
+    assert [(event.f_type, bytes(event.payload))
+            for event in client.events()] == [('latin_1', b'caf\xe9'),
+                                              ('compare', b'c')]
+
+
+def test_custom_opcodes_stay_with_their_connection():
+    custom('SERVER')
+    plain = ws.Connection('CLIENT')
+    with pytest.raises(ws.NnwsProtocolError):
+        plain.recv(custom('SERVER').send(ws.SendFrame(b'x', 'latin_1')))
+    assert 'latin_1' not in plain.optable.type_frames
+    with pytest.raises(ws.NnwsProtocolError):
+        ws.Connection('SERVER').send(ws.SendFrame(b'x', 'latin_1'))
+
+
+def test_tables_are_shared():
+    assert custom('SERVER').optable is custom('CLIENT').optable
+    assert ws.Connection('SERVER').optable is ws.Connection('CLIENT').optable
+    assert custom('SERVER').optable is not ws.Connection('SERVER').optable
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'opcode_non_control_mod': {8: 'nope'}},
+    {'opcode_control_mod': {3: 'nope'}},
+])
+def test_opcode_ranges(kwargs):
+    with pytest.raises(ValueError):
+        ws.Connection('SERVER', **kwargs)
@@ -0,0 +1,149 @@
+import os
+import random
+import socket
+
+import pytest
+
+import noio_ws as ws
+
+
+SIZES = (0, 5, 125, 126, 300, 65535, 65536, 200000)
+
+
+def payloads(conn):
+    return [bytes(event.payload) for event in conn.events()]
+
+
+def test_drains_every_frame_in_a_chunk():
+    data = b''.join(ws.Connection('SERVER').send(ws.SendFrame('m%d' % i, 'text'))
+                    for i in range(50))
+    conn = ws.Connection('CLIENT')
+    conn.recv(data)
+    assert payloads(conn) == [b'm%d' % i for i in range(50)]
+    assert conn.next_event() is ws.Information.NEED_DATA
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+def test_frames_split_across_chunks(role, peer):
+    rand = random.Random(role)
+    sender, receiver = ws.Connection(role), ws.Connection(peer)
+    for size in SIZES:
+        payload = os.urandom(size)
+        data = sender.send(ws.SendFrame(payload, 'binary')) * 2
+        got = []
+        i = 0
+        while i < len(data):
+            n = rand.randint(1, 5000)
+            receiver.recv(data[i:i + n])
+            i += n
+            got.extend(payloads(receiver))
+        assert got == [payload, payload], size
+
+
+def test_interleaved_control_frames():
+    sender = ws.Connection('SERVER')
+    data = (sender.send(ws.SendFrame(b'a', 'text', fin=False)) +
+            sender.send(ws.SendFrame(b'p', 'ping')) +
+            sender.send(ws.SendFrame(b'b', 'continue', fin=False)) +
+            sender.send(ws.SendFrame(b'c', 'continue')) +
+            sender.send(ws.SendFrame(b'single', 'binary')))
+    conn = ws.Connection('CLIENT', full_message=True)
+    for i in range(0, len(data), 3):
+        conn.recv(data[i:i + 3])
+    assert [(event.f_type, bytes(event.payload))
+            for event in conn.events()] == [('ping', b'p'),
+                                            ('text', b'abc'),
+                                            ('binary', b'single')]
+
+
+def test_recv_into():
+    a, b = socket.socketpair()
+    sender, receiver = ws.Connection('SERVER'), ws.Connection('CLIENT')
+    sent = [os.urandom(size) for size in (10, 70000, 3)]
+    with a, b:
+        for payload in sent:
+            a.sendall(sender.send(ws.SendFrame(payload, 'binary')))
+        got = []
+        while len(got) < len(sent):
+            n = b.recv_into(receiver.get_buffer(4096))
+            receiver.buffer_updated(n)
+            got.extend(payloads(receiver))
+    assert got == sent
+
+
+def test_unknown_opcode():
+    conn = ws.Connection('CLIENT')
+    with pytest.raises(ws.NnwsProtocolError):
+        conn.recv(b'\x83\x00')
+
+
+@pytest.mark.parametrize('data, error', [
+    # A masked frame from a server.
+    (b'\x82\x81\x00\x00\x00\x00x', ws.NnwsProtocolError),
+    # A ping without fin set.
+    (b'\x09\x01x', ws.NnwsProtocolError),
+    # A new text message before the last one finished.
+    (b'\x01\x01x\x01\x01y', ws.NnwsProtocolError),
+    # A length with the top bit set.
+    (b'\x82\x7f\x80' + bytes(7), ws.NnwsMessageTooBigError),
+])
+def test_bad_headers(data, error):
+    conn = ws.Connection('CLIENT')
+    with pytest.raises(error):
+        conn.recv(data)
+        list(conn.events())
+
+
+@pytest.mark.parametrize('rsv', range(8))
+def test_reserved_bits(rsv):
+    conn = ws.Connection('CLIENT')
+    conn.recv(bytes((0x82 | rsv << 4, 1)) + b'x')
+    event = conn.next_event()
+    assert tuple(event.reserved) == ((rsv >> 2) & 1, (rsv >> 1) & 1, rsv & 1)
+
+
+def test_buffer_stays_bounded():
+    # A frame and a half at a time, so the buffer never empties out.
+    frame = ws.Connection('SERVER').send(ws.SendFrame(bytes(1000), 'binary'))
+    data = frame * 3000
+    conn = ws.Connection('CLIENT')
+    step = len(frame) * 3 // 2
+    for i in range(0, len(data), step):
+        conn.recv(data[i:i + step])
+        list(conn.events())
+        assert len(conn.recvr.buffer) <= 4 * step
+
+
+def test_get_buffer_size():
+    conn = ws.Connection('CLIENT')
+    assert len(conn.get_buffer(100000)) >= 100000
+    assert len(conn.get_buffer()) > 0
+    view = conn.get_buffer(10)
+    with pytest.raises(ValueError):
+        conn.buffer_updated(len(view) + 1)
+
+
+def test_buffer_updated_without_get_buffer():
+    with pytest.raises(ws.NnwsProtocolError):
+        ws.Connection('CLIENT').buffer_updated(1)
+
+
+@pytest.mark.parametrize('full_message', [True, False])
+def test_many_fragments(full_message):
+    sender = ws.Connection('SERVER')
+    pieces = [os.urandom(100) for _ in range(5000)]
+    data = [sender.send(ws.SendFrame(pieces[0], 'binary', fin=False))]
+    data += [sender.send(ws.SendFrame(piece, 'continue', fin=False))
+             for piece in pieces[1:-1]]
+    data.append(sender.send(ws.SendFrame(pieces[-1], 'continue')))
+    conn = ws.Connection('CLIENT', full_message=full_message)
+    events = []
+    for frame in data:
+        conn.recv(frame)
+        events.extend(conn.events())
+    if full_message:
+        message, = events
+        assert bytes(message.payload) == b''.join(pieces)
+    else:
+        assert [bytes(event.payload) for event in events] == pieces
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import noio_ws as ws
+
+
+def received(conn, data):
+    conn.recv(bytes(data))
+    return [(event.f_type, bytes(event.payload)) for event in conn.events()]
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+def test_matches_sending_one_at_a_time(role, peer):
+    payloads = [os.urandom(size) for size in (0, 1, 125, 126, 70000)]
+    frames = ([(payload, 'binary') for payload in payloads] +
+              [ws.SendFrame('hi', 'text'), ('p', 'ping')])
+    data = ws.Connection(role).send_many(frames)
+    assert received(ws.Connection(peer), data) == (
+        [('binary', payload) for payload in payloads] +
+        [('text', b'hi'), ('ping', b'p')])
+
+
+def test_prepared_frames():
+    prepared = ws.PreparedFrame(ws.SendFrame(b'data', 'binary'))
+    data = ws.Connection('SERVER').send_many([prepared, (b'more', 'binary')])
+    assert received(ws.Connection('CLIENT'), data) == [('binary', b'data'),
+                                                       ('binary', b'more')]
+
+
+def test_close_must_come_last():
+    conn = ws.Connection('CLIENT')
+    with pytest.raises(ws.NnwsProtocolError):
+        conn.send_many([ws.SendFrame(b'', 'close'), (b'x', 'binary')])
+
+
+def test_close_moves_to_closing():
+    conn = ws.Connection('CLIENT')
+    conn.send_many([(b'x', 'binary'), ws.SendFrame(b'', 'close')])
+    assert conn.state is ws.constants.CStates.CLOSING
+
+
+def closing_server():
+    conn = ws.Connection('SERVER')
+    conn.send(ws.SendFrame(b'', 'close'))
+    return conn
+
+
+@pytest.mark.parametrize('frame', [
+    (b'data', 'binary'),
+    ws.SendFrame(b'data', 'binary'),
+    ws.PreparedFrame(ws.SendFrame(b'data', 'binary')),
+])
+def test_no_data_frames_while_closing(frame):
+    with pytest.raises(ws.NnwsProtocolError):
+        closing_server().send_many([frame])
+
+
+def test_close_reply_while_closing():
+    conn = ws.Connection('SERVER')
+    conn.recv(ws.Connection('CLIENT').send(ws.SendFrame(b'', 'close')))
+    conn.next_event()
+    conn.send_many([ws.SendFrame(b'', 'close')])
+    assert conn.state is ws.constants.CStates.CLOSED
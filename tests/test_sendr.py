@@ -0,0 +1,79 @@
+import socket
+
+import pytest
+
+import noio_ws as ws
+
+
+# A 50 byte binary frame from a server, with its 2 byte header.
+FRAME_SIZE = 52
+
+
+def fill(conn, count):
+    return [conn.write(ws.SendFrame(b'x' * 50, 'binary'))
+            for _ in range(count)]
+
+
+def test_water_marks():
+    conn = ws.Connection('SERVER', high_water=1000, low_water=200)
+    results = fill(conn, 30)
+    blocked_at = results.index(ws.Information.WRITE_BLOCKED)
+    assert (blocked_at + 1) * FRAME_SIZE > 1000 >= blocked_at * FRAME_SIZE
+    assert all(results[blocked_at:])
+    assert conn.write_blocked and len(conn.sendr) == 30 * FRAME_SIZE
+
+    assert len(conn.bytes_to_send(600)) == 600
+    conn.data_sent(600)
+    # Still above low_water.
+    assert conn.write_blocked
+    conn.data_sent(800)
+    assert not conn.write_blocked
+    assert len(conn.sendr) == 30 * FRAME_SIZE - 1400
+
+    assert len(conn.data_to_send()) == 30 * FRAME_SIZE - 1400
+    assert len(conn.sendr) == 0
+    assert conn.write(ws.SendFrame(b'x', 'text')) is None
+
+
+def test_unbounded_by_default():
+    conn = ws.Connection('SERVER')
+    assert not any(fill(conn, 1000))
+    assert not conn.write_blocked
+
+
+def test_low_water_above_high_water():
+    with pytest.raises(ValueError):
+        ws.Connection('SERVER', high_water=100, low_water=200)
+
+
+def test_over_a_socket():
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    b.setblocking(False)
+    sender = ws.Connection('SERVER', high_water=1 << 16)
+    receiver = ws.Connection('CLIENT')
+    received = []
+
+    def read():
+        try:
+            receiver.recv(b.recv(1 << 20))
+        except BlockingIOError:
+            return
+        received.extend(bytes(event.payload) for event in receiver.events())
+
+    def send():
+        try:
+            sender.data_sent(a.send(sender.bytes_to_send()))
+        except BlockingIOError:
+            read()
+
+    with a, b:
+        for i in range(50000):
+            sender.write(ws.SendFrame(b'm%d' % i, 'text'))
+            while sender.write_blocked:
+                send()
+        while len(sender.sendr):
+            send()
+        while len(received) < 50000:
+            read()
+    assert received == [b'm%d' % i for i in range(50000)]
@@ -0,0 +1,113 @@
+import os
+import tracemalloc
+
+import pytest
+
+import noio_ws as ws
+
+MiB = 1 << 20
+
+
+def fragments(data, f_type='binary', size=20000, role='CLIENT', **kwargs):
+    conn = ws.Connection(role, **kwargs)
+    return b''.join(conn.send_fragments(data, f_type, max_frame_size=size))
+
+
+def server(**kwargs):
+    kwargs.setdefault('full_message', True)
+    return ws.Connection('SERVER', **kwargs)
+
+
+def test_small_messages_stay_in_memory():
+    conn = server(spill_threshold=100000)
+    conn.recv(fragments(b'small' * 100))
+    message = conn.next_event()
+    assert not message.spilled
+    assert bytes(message.view()) == b'small' * 100
+
+
+def test_large_messages_are_spilled():
+    data = os.urandom(300000)
+    conn = server(max_buffer=32768, spill_threshold=100000)
+    conn.recv(fragments(data))
+    message = conn.next_event()
+    assert message.spilled
+    assert message.payload.read() == data
+    assert bytes(message.view()) == data
+
+
+def test_spilled_text_is_checked_but_not_decoded():
+    text = 'é' * 100000
+    conn = server(decode_text=True, spill_threshold=100000)
+    conn.recv(fragments(text, 'text'))
+    message = conn.next_event()
+    assert message.spilled and message.decoded_text is None
+    assert message.payload.read().decode('utf-8') == text
+
+    conn = server(spill_threshold=10)
+    with pytest.raises(ws.NnwsInvalidPayloadError):
+        conn.recv(fragments(b'a' * 50 + b'\xff', 'text', size=20))
+        list(conn.events())
+
+
+def test_spill_threshold_needs_full_message():
+    with pytest.raises(ValueError):
+        ws.Connection('SERVER', spill_threshold=10)
+
+
+def test_compressed_spilled_messages():
+    data = os.urandom(300000)
+    conn = server(max_buffer=32768, spill_threshold=100000,
+                  deflate=ws.PerMessageDeflate('SERVER'))
+    conn.recv(fragments(data, deflate=ws.PerMessageDeflate('CLIENT')))
+    message = conn.next_event()
+    assert message.spilled and message.payload.read() == data
+
+
+def test_compressed_frame_inflating_past_max_buffer():
+    # One small frame that inflates to 30 MiB.
+    frame = ws.Connection('CLIENT', deflate=ws.PerMessageDeflate('CLIENT'))\
+        .send(ws.SendFrame(bytes(30 * MiB), 'binary'))
+    assert len(frame) < MiB
+    conn = server(max_buffer=MiB, spill_threshold=MiB,
+                  deflate=ws.PerMessageDeflate('SERVER'))
+    tracemalloc.start()
+    try:
+        with pytest.raises(ws.NnwsMessageTooBigError):
+            conn.recv(frame)
+            list(conn.events())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * MiB
+
+
+def short_fragments(count, size=100):
+    '''One message made of count fragments of size bytes each, all short
+    enough for their length to fit in the frame's second byte.'''
+    conn = ws.Connection('CLIENT')
+    chunk = b'x' * size
+    frames = [conn.send(ws.SendFrame(chunk, 'binary', fin=False))]
+    frames += [conn.send(ws.SendFrame(chunk, 'continue', fin=False))
+               for _ in range(count - 2)]
+    frames.append(conn.send(ws.SendFrame(chunk, 'continue')))
+    return frames
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'spill_threshold': 1000, 'max_spill': 10000},
+    {'max_buffer': 10000},
+])
+def test_short_fragments_are_limited(kwargs):
+    conn = server(**kwargs)
+    with pytest.raises(ws.NnwsMessageTooBigError):
+        for frame in short_fragments(1000):
+            conn.recv(frame)
+    assert conn.recvr.data_f.message_size <= 10000
+
+
+def test_short_fragments_within_the_limit():
+    conn = server(spill_threshold=1000, max_spill=10000)
+    for frame in short_fragments(100):
+        conn.recv(frame)
+    assert conn.next_event().payload.read() == b'x' * 10000
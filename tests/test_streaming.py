@@ -0,0 +1,37 @@
+import os
+import random
+
+import pytest
+
+import noio_ws as ws
+
+
+@pytest.mark.parametrize('role, peer', [('SERVER', 'CLIENT'),
+                                        ('CLIENT', 'SERVER')])
+def test_streamed_chunks(role, peer):
+    rand = random.Random(role)
+    sender = ws.Connection(role)
+    receiver = ws.Connection(peer, stream=True, max_buffer=200)
+    a, b, c = os.urandom(70000), b'', os.urandom(900)
+    data = (sender.send(ws.SendFrame(a, 'binary', fin=False)) +
+            sender.send(ws.SendFrame('p', 'ping')) +
+            sender.send(ws.SendFrame(b, 'continue', fin=False)) +
+            sender.send(ws.SendFrame(c, 'continue')) +
+            sender.send(ws.SendFrame('', 'text')))
+    events = []
+    i = 0
+    while i < len(data):
+        n = rand.randint(1, 3000)
+        receiver.recv(data[i:i + n])
+        i += n
+        events.extend(receiver.events())
+    chunks = [event for event in events
+              if isinstance(event, ws.PayloadChunk)]
+    # Frames far over max_buffer are fine, as bodies are handed over as they
+    # arrive rather than buffered.
+    assert all(len(chunk.payload) <= 3000 for chunk in chunks)
+    assert b''.join(bytes(chunk.payload) for chunk in chunks
+                    if chunk.f_type == 'binary') == a + b + c
+    assert [chunk.message_fin for chunk in chunks].count(True) == 2
+    assert [event.f_type for event in events
+            if not isinstance(event, ws.PayloadChunk)] == ['ping']
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from noio_ws.timers import TimerWheel
+
+
+@pytest.mark.parametrize('resolution, slots, levels', [
+    (1.0, 4, 2),
+    (0.5, 8, 3),
+    (0.1, 256, 4),
+    # Far less reach than the deadlines, so most get parked.
+    (1, 3, 1),
+])
+def test_against_a_dict(resolution, slots, levels):
+    rand = random.Random(slots)
+    wheel = TimerWheel(0, resolution, slots, levels)
+    deadlines = {}
+    for key in range(3000):
+        deadlines[key] = rand.uniform(0, 500 if key % 3 else 5)
+        wheel.schedule(key, deadlines[key])
+    for key in range(0, 3000, 7):
+        wheel.cancel(key)
+        del deadlines[key]
+    for key in range(1, 3000, 11):
+        if key in deadlines:
+            deadlines[key] = rand.uniform(0, 600)
+            wheel.schedule(key, deadlines[key])
+    assert len(wheel) == len(deadlines)
+
+    fired = set()
+    now = 0
+    while now < 700:
+        step = rand.uniform(0, 7)
+        now += step
+        for key in wheel.advance(now):
+            # Never early, and at most a tick late.
+            assert deadlines[key] <= now
+            assert now - deadlines[key] <= step + resolution
+            assert key not in fired
+            fired.add(key)
+    assert fired == set(deadlines)
+    assert len(wheel) == 0
+
+
+def test_reschedule_and_cancel():
+    wheel = TimerWheel(100, resolution=1)
+    wheel.schedule('a', 105)
+    wheel.schedule('b', 103)
+    wheel.schedule('a', 102)
+    assert 'a' in wheel and len(wheel) == 2
+    assert wheel.advance(101) == []
+    assert wheel.advance(102) == ['a']
+    wheel.schedule('b', None)
+    assert 'b' not in wheel
+    assert wheel.advance(200) == []
+
+
+def test_past_deadlines_fire_on_next_tick():
+    wheel = TimerWheel(0, resolution=1)
+    wheel.advance(10)
+    wheel.schedule('late', 3)
+    assert wheel.advance(11) == ['late']
+
+
+def test_bad_arguments():
+    with pytest.raises(ValueError):
+        TimerWheel(0, resolution=0)
+    with pytest.raises(ValueError):
+        TimerWheel(0, slots=1)
@@ -0,0 +1,46 @@
+import pytest
+
+import noio_ws as ws
+
+
+TEXT = 'héllo wörld ✓ 𝄞'.encode()
+MODES = [{}, {'full_message': True}, {'stream': True}]
+
+
+@pytest.mark.parametrize('kwargs', MODES)
+def test_text_split_mid_character(kwargs):
+    sender = ws.Connection('SERVER')
+    conn = ws.Connection('CLIENT', decode_text=True, **kwargs)
+    conn.recv(sender.send(ws.SendFrame(TEXT[:2], 'text', fin=False)) +
+              sender.send(ws.SendFrame(TEXT[2:-2], 'continue', fin=False)) +
+              sender.send(ws.SendFrame(TEXT[-2:], 'continue')) +
+              sender.send(ws.SendFrame('plain', 'text')))
+    decoded = [event.decoded_text for event in conn.events()]
+    assert ''.join(text for text in decoded if text) == TEXT.decode() + 'plain'
+
+
+@pytest.mark.parametrize('kwargs', MODES)
+def test_invalid_continuation(kwargs):
+    sender = ws.Connection('SERVER')
+    conn = ws.Connection('CLIENT', **kwargs)
+    conn.recv(sender.send(ws.SendFrame(b'ok', 'text', fin=False)))
+    with pytest.raises(ws.NnwsInvalidPayloadError) as e:
+        conn.recv(sender.send(ws.SendFrame(b'\xff\xfe', 'continue',
+                                           fin=False)))
+        list(conn.events())
+    assert e.value.status_code == 1007
+
+
+@pytest.mark.parametrize('kwargs', MODES)
+def test_truncated_character(kwargs):
+    conn = ws.Connection('CLIENT', **kwargs)
+    with pytest.raises(ws.NnwsInvalidPayloadError):
+        conn.recv(ws.Connection('SERVER').send(
+            ws.SendFrame(b'ab\xe2\x9c', 'text')))
+        list(conn.events())
+
+
+def test_binary_is_not_checked():
+    conn = ws.Connection('CLIENT')
+    conn.recv(ws.Connection('SERVER').send(ws.SendFrame(b'\xff', 'binary')))
+    assert bytes(conn.next_event().payload) == b'\xff'